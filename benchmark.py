@@ -0,0 +1,309 @@
+"""Offline load test for the proxy.
+
+Starts stub_upstream.py and the proxy (with config.py, pointed at the stub), then drives /api/chat with
+mixed streaming and non-streaming requests at each concurrency level. The same load is sent directly to
+the stub as a baseline, so the report shows the latency the proxy adds. Results are printed as JSON.
+Example:
+
+    python benchmark.py --concurrency 1 16 64 --duration 10 --output bench.json
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+from typing import List, Dict, Any, Optional
+from stub_upstream import STUB_VOCABULARY
+
+BENCHMARK_DIR: str = os.path.dirname(os.path.abspath(__file__))
+_CLOCK_TICKS: int = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_STUB_VOCABULARY_OFFSETS: List[int] = [sum(len(token) for token in STUB_VOCABULARY[:i + 1]) for i in range(len(STUB_VOCABULARY))]
+
+def _stub_tokens_in_text(text_length: int) -> int:
+    """Number of stub tokens in the first `text_length` characters of a response. The stub always emits the
+    same token sequence, so this maps proxy chunks (which may merge several upstream events) back to tokens."""
+    full_cycles, remainder = divmod(text_length, _STUB_VOCABULARY_OFFSETS[-1])
+    return full_cycles * len(STUB_VOCABULARY) + bisect.bisect_right(_STUB_VOCABULARY_OFFSETS, remainder)
+
+class RequestResult:
+    __slots__ = ("stream", "outcome", "ttft", "token_gaps", "tokens", "duration", "_text_length")
+
+    def __init__(self, stream: bool):
+        self.stream = stream; self.outcome = "ok"; self.ttft: Optional[float] = None
+        self.token_gaps: List[float] = []; self.tokens = 0; self.duration = 0.0; self._text_length = 0
+
+    def record_chunk(self, content: str, gap: Optional[float]) -> None:
+        """Spreads the gap before a chunk over the tokens it carries, so proxy output (merged by the flush
+        interval) and direct stub events are compared per token rather than per chunk."""
+        tokens_before = _stub_tokens_in_text(self._text_length); self._text_length += len(content)
+        chunk_tokens = max(1, _stub_tokens_in_text(self._text_length) - tokens_before)
+        if gap is not None: self.token_gaps.extend([gap / chunk_tokens] * chunk_tokens)
+
+class ProcessTreeSampler:
+    """CPU time and resident memory of a process and its children (worker processes), read from /proc."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+
+    def _tree_pids(self) -> List[int]:
+        children: Dict[int, List[int]] = {}
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit(): continue
+            try:
+                with open(f"/proc/{entry}/stat") as f: parent_pid = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError): continue
+            children.setdefault(parent_pid, []).append(int(entry))
+        tree_pids, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop(); tree_pids.append(pid); pending.extend(children.get(pid, []))
+        return tree_pids
+
+    def cpu_seconds(self) -> float:
+        total_ticks = 0
+        for pid in self._tree_pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f: stat_fields = f.read().rsplit(")", 1)[1].split()
+                total_ticks += int(stat_fields[11]) + int(stat_fields[12])
+            except (OSError, IndexError, ValueError): continue
+        return total_ticks / _CLOCK_TICKS
+
+    def rss_bytes(self) -> int:
+        total_bytes = 0
+        for pid in self._tree_pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"): total_bytes += int(line.split()[1]) * 1024; break
+            except (OSError, ValueError): continue
+        return total_bytes
+
+def _percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values: return None
+    ordered = sorted(values)
+    def pick(fraction: float) -> float: return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return {"p50": round(pick(0.5) * 1000, 3), "p90": round(pick(0.9) * 1000, 3), "p99": round(pick(0.99) * 1000, 3), "max": round(ordered[-1] * 1000, 3)}
+
+def _percentile_delta(proxy_stats: Optional[Dict[str, float]], direct_stats: Optional[Dict[str, float]]) -> Optional[Dict[str, float]]:
+    if not proxy_stats or not direct_stats: return None
+    return {key: round(proxy_stats[key] - direct_stats[key], 3) for key in proxy_stats}
+
+# Load Generation
+async def _send_proxy_request(session: aiohttp.ClientSession, base_url: str, model: str, prompt: str, stream: bool) -> RequestResult:
+    result = RequestResult(stream); started_at = time.perf_counter(); last_chunk_at = None
+    body = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": stream, "options": {"cache": False}}
+    async with session.post(f"{base_url}/api/chat", json=body) as response:
+        if response.status != 200:
+            result.outcome = f"http_{response.status}"; await response.read(); return result
+        async for line in response.content:
+            if not line.strip(): continue
+            chunk = json.loads(line)
+            if chunk.get("error"): result.outcome = "upstream_error"; break
+            if chunk.get("message", {}).get("content"):
+                now = time.perf_counter()
+                if last_chunk_at is None: result.ttft = now - started_at
+                result.record_chunk(chunk["message"]["content"], now - last_chunk_at if last_chunk_at is not None else None)
+                last_chunk_at = now
+            if chunk.get("done"): result.tokens = chunk.get("eval_count") or 0
+    result.duration = time.perf_counter() - started_at
+    if not stream: result.ttft = None
+    return result
+
+async def _send_direct_request(session: aiohttp.ClientSession, base_url: str, model: str, prompt: str, stream: bool) -> RequestResult:
+    result = RequestResult(stream); started_at = time.perf_counter(); last_chunk_at = None
+    body = {"model": model, "messages": [{"role": "user", "content": prompt}], "stream": stream}
+    async with session.post(f"{base_url}/v1/chat/completions", json=body) as response:
+        if response.status != 200:
+            result.outcome = "upstream_error"; await response.read(); return result
+        if not stream:
+            result.tokens = (await response.json()).get("usage", {}).get("completion_tokens", 0)
+        else:
+            completed = False
+            try:
+                async for line in response.content:
+                    if not line.startswith(b"data:"): continue
+                    payload = line[5:].strip()
+                    if payload == b"[DONE]": completed = True; break
+                    chunk = json.loads(payload)
+                    if chunk.get("choices") and chunk["choices"][0].get("delta", {}).get("content"):
+                        now = time.perf_counter()
+                        if last_chunk_at is None: result.ttft = now - started_at
+                        result.record_chunk(chunk["choices"][0]["delta"]["content"], now - last_chunk_at if last_chunk_at is not None else None)
+                        last_chunk_at = now
+                    if chunk.get("usage"): result.tokens = chunk["usage"].get("completion_tokens", 0)
+            except aiohttp.ClientPayloadError: pass  # Injected mid-stream drop.
+            if not completed: result.outcome = "upstream_error"
+    result.duration = time.perf_counter() - started_at
+    return result
+
+async def run_load_level(target: str, base_url: str, settings: argparse.Namespace, concurrency: int) -> Dict[str, Any]:
+    """Keeps `concurrency` requests open against `target` ("proxy" or "direct") for settings.duration seconds."""
+    send_request = _send_proxy_request if target == "proxy" else _send_direct_request
+    results: List[RequestResult] = []
+    open_streams = {"now": 0, "peak": 0}
+    request_counter = iter(range(1 << 62))
+    deadline = time.perf_counter() + settings.duration
+    filler = ("lorem ipsum " * (settings.prompt_chars // 12 + 1))[:settings.prompt_chars]
+
+    async def client_loop(client_index: int) -> None:
+        while time.perf_counter() < deadline:
+            request_number = next(request_counter)
+            stream = int((request_number + 1) * settings.stream_ratio) > int(request_number * settings.stream_ratio)
+            prompt = f"benchmark {target} {concurrency} {request_number}: {filler}"
+            open_streams["now"] += 1; open_streams["peak"] = max(open_streams["peak"], open_streams["now"])
+            try: results.append(await send_request(session, base_url, settings.model, prompt, stream))
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                failed = RequestResult(stream); failed.outcome = "transport_error"; results.append(failed)
+            finally: open_streams["now"] -= 1
+
+    timeout = aiohttp.ClientTimeout(total=settings.request_timeout)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        await asyncio.gather(*(client_loop(client_index) for client_index in range(concurrency)))
+
+    outcomes: Dict[str, int] = {}
+    for result in results: outcomes[result.outcome] = outcomes.get(result.outcome, 0) + 1
+    succeeded = [result for result in results if result.outcome == "ok"]
+    return {"requests": len(results), "outcomes": outcomes, "peak_open_requests": open_streams["peak"],
+            "tokens": sum(result.tokens for result in succeeded),
+            "tokens_per_second": round(sum(result.tokens for result in succeeded) / settings.duration, 1),
+            "ttft_ms": _percentiles([result.ttft for result in succeeded if result.ttft is not None]),
+            "inter_token_ms": _percentiles([gap for result in succeeded for gap in result.token_gaps]),
+            "stream_duration_ms": _percentiles([result.duration for result in succeeded if result.stream]),
+            "non_stream_duration_ms": _percentiles([result.duration for result in succeeded if not result.stream])}
+
+# Process Management
+def _start_stub(settings: argparse.Namespace) -> subprocess.Popen:
+    stub_command = [sys.executable, os.path.join(BENCHMARK_DIR, "stub_upstream.py"), "--host", "127.0.0.1", "--port", str(settings.stub_port),
+                    "--tokens-per-second", str(settings.tokens_per_second), "--ttft", str(settings.ttft), "--chunk-size", str(settings.chunk_size),
+                    "--tokens", str(settings.tokens), "--error-rate", str(settings.error_rate), "--drop-rate", str(settings.drop_rate),
+                    "--models", settings.model, "--seed", "0"]
+    return subprocess.Popen(stub_command, stdout=subprocess.DEVNULL)
+
+def _start_proxy(settings: argparse.Namespace, stub_url: str, config_dir: str) -> subprocess.Popen:
+    """Runs main.py with the repository's config.py plus overrides that point it at the stub."""
+    with open(os.path.join(BENCHMARK_DIR, "config.py"), encoding="utf-8") as f: config_text = f.read()
+    overrides = [f'API_TOKEN = "benchmark"', f'API_URL = "{stub_url}/v1/chat/completions"', "UPSTREAM_ENDPOINTS = []",
+                 'SERVER_HOST = "127.0.0.1"', f"SERVER_PORT = {settings.proxy_port}", "RESPONSE_CACHE_ENABLED = False",
+                 "RESPONSE_CACHE_PERSIST_PATH = None", "DEBUG_MODE = False"]
+    overrides.extend(f"{key.strip()} = {value.strip()}" for key, value in (assignment.split("=", 1) for assignment in settings.set))
+    with open(os.path.join(config_dir, "config.py"), "w", encoding="utf-8") as f:
+        f.write(config_text + "\n\n# --- Benchmark overrides ---\n" + "\n".join(overrides) + "\n")
+    run_main = "import runpy, sys; sys.path.insert(0, sys.argv[1]); runpy.run_path(sys.argv[2], run_name='__main__')"
+    return subprocess.Popen([sys.executable, "-c", run_main, config_dir, os.path.join(BENCHMARK_DIR, "main.py")], cwd=config_dir, stdout=subprocess.DEVNULL)
+
+async def _wait_until_ready(url: str, process: Optional[subprocess.Popen], timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None: raise SystemExit(f"[Fatal Error] Process serving {url} exited with code {process.returncode}.")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200: return
+            except aiohttp.ClientError: pass
+            await asyncio.sleep(0.2)
+    raise SystemExit(f"[Fatal Error] {url} did not become ready within {timeout}s.")
+
+def _stop_process(process: Optional[subprocess.Popen]) -> None:
+    if process is None or process.poll() is not None: return
+    process.terminate()
+    try: process.wait(timeout=40)
+    except subprocess.TimeoutExpired: process.kill(); process.wait()
+
+# Benchmark
+async def run_benchmark(settings: argparse.Namespace) -> Dict[str, Any]:
+    stub_process = proxy_process = None
+    config_dir = tempfile.mkdtemp(prefix="ollama-proxy-bench-")
+    stub_url = settings.stub_url or f"http://127.0.0.1:{settings.stub_port}"
+    proxy_url = settings.proxy_url or f"http://127.0.0.1:{settings.proxy_port}"
+    try:
+        if not settings.stub_url: stub_process = _start_stub(settings)
+        await _wait_until_ready(f"{stub_url}/v1/models", stub_process)
+        if not settings.proxy_url: proxy_process = _start_proxy(settings, stub_url, config_dir)
+        await _wait_until_ready(f"{proxy_url}/api/version", proxy_process)
+        sampler_pid = proxy_process.pid if proxy_process is not None else settings.proxy_pid
+        sampler = ProcessTreeSampler(sampler_pid) if sampler_pid and os.path.isdir("/proc") else None
+
+        warmup_settings = argparse.Namespace(**{**vars(settings), "duration": settings.warmup})
+        if settings.warmup > 0: await run_load_level("proxy", proxy_url, warmup_settings, 2)
+        rss_at_start = sampler.rss_bytes() if sampler else None
+
+        levels = []
+        for concurrency in settings.concurrency:
+            print(f"Concurrency {concurrency}: running {settings.duration}s against the stub and the proxy...", file=sys.stderr)
+            direct = await run_load_level("direct", stub_url, settings, concurrency) if not settings.no_baseline else None
+            cpu_before = sampler.cpu_seconds() if sampler else None
+            proxy = await run_load_level("proxy", proxy_url, settings, concurrency)
+            level = {"concurrency": concurrency, "proxy": proxy, "direct": direct,
+                     "ttft_delta_ms": _percentile_delta(proxy["ttft_ms"], direct["ttft_ms"]) if direct else None,
+                     "inter_token_delta_ms": _percentile_delta(proxy["inter_token_ms"], direct["inter_token_ms"]) if direct else None,
+                     "proxy_cpu_seconds": None, "proxy_cpu_us_per_token": None, "proxy_rss_mb": None}
+            if sampler:
+                cpu_seconds = sampler.cpu_seconds() - cpu_before
+                level["proxy_cpu_seconds"] = round(cpu_seconds, 3)
+                level["proxy_cpu_us_per_token"] = round(cpu_seconds * 1e6 / proxy["tokens"], 2) if proxy["tokens"] else None
+                level["proxy_rss_mb"] = round(sampler.rss_bytes() / (1024 * 1024), 1)
+            unexpected_failures = sum(count for outcome, count in proxy["outcomes"].items() if outcome not in ("ok", "upstream_error"))
+            ttft_delta_p99 = (level["ttft_delta_ms"] or {}).get("p99", 0.0)
+            level["sustained"] = unexpected_failures == 0 and ttft_delta_p99 <= settings.ttft_slo_ms
+            levels.append(level)
+
+        rss_at_end = sampler.rss_bytes() if sampler else None
+        sustained_levels = [level["concurrency"] for level in levels if level["sustained"]]
+        return {"settings": vars(settings),
+                "levels": levels,
+                "max_sustained_streams": max(sustained_levels) if sustained_levels else 0,
+                "proxy_rss_growth_mb": round((rss_at_end - rss_at_start) / (1024 * 1024), 1) if sampler else None}
+    finally:
+        _stop_process(proxy_process); _stop_process(stub_process)
+        shutil.rmtree(config_dir, ignore_errors=True)
+
+def _print_summary(report: Dict[str, Any]) -> None:
+    print(f"{'streams':>8} {'req':>7} {'tok/s':>9} {'TTFT p50/p99 +ms':>18} {'gap p50/p99 +ms':>17} {'cpu us/tok':>11} {'rss MB':>7}  ok", file=sys.stderr)
+    for level in report["levels"]:
+        ttft_delta = level["ttft_delta_ms"] or {}; gap_delta = level["inter_token_delta_ms"] or {}
+        print(f"{level['concurrency']:>8} {level['proxy']['requests']:>7} {level['proxy']['tokens_per_second']:>9} "
+              f"{str(ttft_delta.get('p50'))+'/'+str(ttft_delta.get('p99')):>18} {str(gap_delta.get('p50'))+'/'+str(gap_delta.get('p99')):>17} "
+              f"{str(level['proxy_cpu_us_per_token']):>11} {str(level['proxy_rss_mb']):>7}  {'yes' if level['sustained'] else 'NO'}", file=sys.stderr)
+    print(f"Max sustained streams: {report['max_sustained_streams']}, RSS growth: {report['proxy_rss_growth_mb']} MB", file=sys.stderr)
+
+def build_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Offline load test measuring the latency and CPU the proxy adds.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128], help="Concurrent requests per level")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per level and target")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds of warm-up traffic before measuring")
+    parser.add_argument("--stream-ratio", type=float, default=0.8, help="Fraction of streaming requests")
+    parser.add_argument("--prompt-chars", type=int, default=200, help="Prompt length in characters")
+    parser.add_argument("--model", default="benchmark-model")
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--ttft-slo-ms", type=float, default=250.0, help="p99 TTFT the proxy may add for a level to count as sustained")
+    parser.add_argument("--no-baseline", action="store_true", help="Skip the direct-to-stub baseline (no deltas are reported)")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    stub_group = parser.add_argument_group("stub upstream")
+    stub_group.add_argument("--stub-url", help="Use an already running stub instead of starting stub_upstream.py")
+    stub_group.add_argument("--stub-port", type=int, default=18101)
+    stub_group.add_argument("--tokens-per-second", type=float, default=50.0)
+    stub_group.add_argument("--ttft", type=float, default=0.2)
+    stub_group.add_argument("--chunk-size", type=int, default=1)
+    stub_group.add_argument("--tokens", type=int, default=128)
+    stub_group.add_argument("--error-rate", type=float, default=0.0)
+    stub_group.add_argument("--drop-rate", type=float, default=0.0)
+    proxy_group = parser.add_argument_group("proxy")
+    proxy_group.add_argument("--proxy-url", help="Benchmark an already running proxy instead of starting main.py")
+    proxy_group.add_argument("--proxy-pid", type=int, help="PID of the running proxy, for CPU and memory figures")
+    proxy_group.add_argument("--proxy-port", type=int, default=18100)
+    proxy_group.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Extra config.py assignment for the started proxy, e.g. --set WORKERS=4")
+    return parser
+
+if __name__ == "__main__":
+    benchmark_settings = build_argument_parser().parse_args()
+    benchmark_report = asyncio.run(run_benchmark(benchmark_settings))
+    _print_summary(benchmark_report)
+    report_json = json.dumps(benchmark_report, indent=2)
+    if benchmark_settings.output:
+        with open(benchmark_settings.output, "w", encoding="utf-8") as f: f.write(report_json + "\n")
+    else: print(report_json)
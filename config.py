@@ -45,4 +45,143 @@ INCLUDE_STOP_STR_IN_OUTPUT = None       # bool: API default typically False
 SPACES_BETWEEN_SPECIAL_TOKENS = None    # bool: API default often True
 
 # Response format, Example: {"type": "json_object"}
-RESPONSE_FORMAT = None
\ No newline at end of file
+RESPONSE_FORMAT = None
+
+# --- Response Cache ---
+# Deterministic chat requests (fixed seed and/or temperature 0, or options {"cache": true} from the client)
+# are answered from memory when the exact same backend request was already completed once.
+RESPONSE_CACHE_ENABLED = False
+RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024   # int: Memory budget for cached responses, least recently used entries are evicted first
+RESPONSE_CACHE_PERSIST_PATH = None           # str: JSON file to load the cache from on start and merge it into on shutdown (shared safely by WORKERS), None to keep it in memory only
+RESPONSE_CACHE_REPLAY_DELAY = 0.0            # float: Seconds to wait between replayed chunks on a streamed cache hit, 0 replays at once
+
+# --- Request Coalescing ---
+# Identical chat requests that arrive while the first one is still streaming share its backend stream
+# instead of opening a new one. Each attached client receives the tokens produced so far, then the live tail.
+REQUEST_COALESCING_ENABLED = True
+
+# --- Streaming Output ---
+# Tokens that arrive within STREAM_FLUSH_INTERVAL seconds of the previous write are merged into one chunk,
+# so fast models cause fewer writes. A token arriving after an idle gap is always written immediately.
+STREAM_FLUSH_INTERVAL = 0.01
+STREAM_FLUSH_MAX_CHARS = 4096     # int: Write a merged chunk early once it holds this many characters
+
+# --- Upstream Endpoints ---
+# OpenAI-compatible backends to route chat requests to. Leave empty to use API_URL and API_TOKEN above.
+# Requests go to the endpoint with the best moving-average time-to-first-token, error rate and load (divided by weight).
+# If an endpoint fails with a connection error, 408, 429 or 5xx before the first token, the next one is tried.
+# Example:
+# UPSTREAM_ENDPOINTS = [
+#     {"name": "chutes", "url": "https://llm.chutes.ai/v1/chat/completions", "token": "cpk_...", "weight": 2},
+#     {"name": "nineteen", "url": "https://api.nineteen.ai/v1/chat/completions", "token": "...",
+#      "model_map": {"deepseek-ai/DeepSeek-V3-0324": "deepseek-ai/DeepSeek-V3"}},
+#     {"name": "local-vllm", "url": "http://127.0.0.1:8000/v1/chat/completions", "token": "none",
+#      "models": ["Qwen/Qwen2.5-7B-Instruct"]},
+# ]
+# Optional keys per entry: "token" (defaults to API_TOKEN), "weight" (default 1), "model_map" (client model -> backend model),
+# "models" (only route these models here), "health_url" (defaults to the /models URL next to "url"),
+# "max_concurrency" (defaults to UPSTREAM_MAX_CONCURRENCY), "embeddings_url" (defaults to the /embeddings URL next to "url"),
+# "embedding_models" (only route these embedding models here; "models" above only restricts chat models),
+# "continuation_mode" (defaults to STREAM_CONTINUATION_MODE, "none" never sends continuations to this endpoint),
+# "models_url" (model list for the model catalog, defaults to the /models URL next to "url").
+UPSTREAM_ENDPOINTS = []
+UPSTREAM_MAX_ATTEMPTS = 3                 # int: Endpoints tried per request before the error is returned to the client
+UPSTREAM_HEALTH_CHECK_INTERVAL = 30       # float: Seconds between background health probes, 0 disables them
+UPSTREAM_CIRCUIT_FAILURE_THRESHOLD = 5    # int: Consecutive failures that open an endpoint's circuit breaker
+UPSTREAM_CIRCUIT_OPEN_SECONDS = 30        # float: Seconds an open circuit rejects traffic before one trial request is let through
+UPSTREAM_MAX_CONCURRENCY = 32             # int: Concurrent requests per endpoint. Halved on 429 responses, then grown back by one per window of successes
+
+# --- Model Catalog ---
+# /api/tags, /api/show and /v1/models list the models the upstream endpoints report on their /models URL, and chat
+# requests are only routed to endpoints listing the model. The list is kept in memory and refreshed in the background
+# once it is older than MODEL_CATALOG_TTL, so requests never wait for it. Until the first list was fetched, MODEL_NAME
+# and MODEL_ALIASES are listed instead and every model is forwarded.
+MODEL_CATALOG_ENABLED = True
+MODEL_CATALOG_TTL = 300                 # float: Seconds before the model list is refreshed
+MODEL_CATALOG_RETRY_INTERVAL = 30       # float: Seconds before a failed refresh is retried
+MODEL_CATALOG_REJECT_UNKNOWN = True     # bool: Answer 404 for chat models no upstream lists, without sending the request
+MODEL_ALIASES = {}                      # dict[str, str]: Ollama-style names for backend model ids, listed in /api/tags. Example: {"deepseek-v3:latest": "deepseek-ai/DeepSeek-V3-0324", "qwen2.5:7b": "Qwen/Qwen2.5-7B-Instruct"}
+
+# --- Hedged Requests ---
+# When no first token has arrived after a running percentile of recent time-to-first-token, send the same request
+# again to the next best endpoint (or the same one if there is only one). The first stream to produce content wins
+# and the other one is cancelled. Counters are shown on GET /api/upstreams.
+HEDGING_ENABLED = False
+HEDGE_TTFT_PERCENTILE = 0.9    # float: Percentile of recent time-to-first-token used as the hedge delay
+HEDGE_MIN_DELAY = 0.25         # float: Lower bound of the hedge delay in seconds
+HEDGE_DEFAULT_DELAY = 2.0      # float: Hedge delay in seconds until enough time-to-first-token samples are collected
+HEDGE_MAX_FRACTION = 0.1       # float: Maximum fraction of requests that may be hedged
+
+# --- Upstream Timeouts ---
+# A timed out attempt counts as a failure of that endpoint. Before the first token the next endpoint is tried,
+# after it the stream is broken (see Stream Continuation below).
+UPSTREAM_CONNECT_TIMEOUT = 10        # float: Seconds to open a connection to an endpoint, None waits indefinitely
+UPSTREAM_FIRST_TOKEN_TIMEOUT = None  # float: Seconds from sending a chat request to its first content token, None disables
+UPSTREAM_IDLE_TIMEOUT = None         # float: Seconds without data from the endpoint, including the wait for response headers. None keeps aiohttp's 5 minute limit on the whole response instead
+
+# --- Stream Continuation ---
+# When a chat stream breaks after content was already sent (connection error, idle timeout, or the stream ending
+# without a finish reason), re-send the request with the partial answer and splice the new tokens into the same
+# client stream instead of ending it with an error. Outcomes are counted in proxy_stream_recoveries_total on /metrics.
+STREAM_CONTINUATION_ENABLED = False
+STREAM_CONTINUATION_MAX_RETRIES = 2               # int: Continuation requests per broken stream
+STREAM_CONTINUATION_MODE = "assistant_prefix"     # str: "assistant_prefix" ends the messages with the partial answer for the model to extend, "continue_turn" adds a user turn with STREAM_CONTINUATION_PROMPT after it
+STREAM_CONTINUATION_PROMPT = "Continue exactly where you stopped. Do not repeat anything."
+STREAM_CONTINUATION_PREFIX_PARAMS = {"continue_final_message": True, "add_generation_prompt": False}  # dict: Extra body fields sent with "assistant_prefix" (vLLM/SGLang names), {} for backends that extend a trailing assistant message by default
+
+# --- Admission Control ---
+# Chat requests that would exceed the available upstream concurrency wait in a bounded queue.
+# Interactive requests are always served before batch requests. Within a class, clients share slots fairly by weight.
+# Full queues are answered immediately with 429 (per client) or 503 (overall) and a Retry-After header.
+ADMISSION_CONTROL_ENABLED = True
+ADMISSION_MAX_CONCURRENCY = 64            # int: Concurrent upstream requests across all endpoints
+ADMISSION_MAX_QUEUE = 256                 # int: Requests allowed to wait for a slot
+ADMISSION_MAX_QUEUE_PER_CLIENT = 32       # int: Requests one client may have waiting
+ADMISSION_QUEUE_TIMEOUT = 30              # float: Seconds a request may wait before it is rejected with 503
+ADMISSION_CLIENT_HEADER = "X-Client-Id"   # str: Header identifying the client. Falls back to the Bearer API key, then the remote address
+ADMISSION_PRIORITY_HEADER = "X-Priority"  # str: Header selecting the priority class, "interactive" (default) or "batch"
+ADMISSION_CLIENT_WEIGHTS = {}             # dict[str, float]: Fair-share weight per client id, default 1. Example: {"webui": 4}
+ADMISSION_BATCH_CLIENTS = []              # list[str]: Client ids always treated as batch traffic
+
+# --- Token Budget History Trimming ---
+# Trim old conversation turns so the prompt fits the model's context window minus max_tokens.
+# System messages and the latest turn are always kept, and older turns are dropped whole, oldest first.
+# Applied after MAX_HISTORY_MESSAGES.
+TOKEN_BUDGET_TRIMMING_ENABLED = False
+DEFAULT_CONTEXT_WINDOW = 32768         # int: Context window in tokens for models not listed below
+MODEL_CONTEXT_WINDOWS = {}             # dict[str, int]: Context window per backend model, Example: {"deepseek-ai/DeepSeek-V3-0324": 131072}
+TOKEN_BUDGET_SAFETY_MARGIN = 64        # int: Tokens kept free for chat template overhead
+TOKENIZER = None                       # None for a fast character-based estimate, "tiktoken" (if installed), or "module:function" taking text and returning a token count
+TOKEN_COUNT_CACHE_SIZE = 10000         # int: Messages whose token counts are remembered
+
+# --- Server Processes ---
+SERVER_HOST = "localhost"        # str: Address to listen on, "0.0.0.0" to accept connections from other machines
+# Worker processes serving requests. They share the listening port (SO_REUSEPORT, Linux/BSD only) and the kernel
+# spreads connections across them. 1 runs everything in this process, 0 starts one worker per CPU core.
+# Sessions, caches, routing state and admission limits are kept per worker; /metrics sums all workers.
+WORKERS = 1
+USE_UVLOOP = True                # bool: Use uvloop as the event loop when it is installed (pip install uvloop)
+WORKER_SHUTDOWN_TIMEOUT = 30     # float: Seconds a stopping server waits for in-flight chat responses to finish
+WORKER_METRICS_INTERVAL = 2      # float: Seconds between metrics snapshots each worker shares for /metrics
+
+# --- Embeddings ---
+# POST /api/embed and /api/embeddings are forwarded to the OpenAI-style /v1/embeddings URL next to each upstream's chat URL
+# (set "embeddings_url" per entry in UPSTREAM_ENDPOINTS to override it). Concurrent requests for the same model are
+# grouped into one upstream call.
+EMBEDDING_MODEL_NAME = None       # str: Embedding model used when the client does not send one
+EMBEDDINGS_API_URL = None         # str: Embeddings URL for API_URL when it does not end in /chat/completions
+EMBEDDING_BATCH_MAX_SIZE = 64     # int: Texts per upstream embeddings request
+EMBEDDING_BATCH_MAX_WAIT = 0.005  # float: Seconds to wait for more texts before sending a batch
+EMBEDDING_CACHE_SIZE = 0          # int: Embeddings remembered by (model, text hash) so unchanged texts are not sent again, 0 disables
+
+# --- Traffic Capture ---
+# Record /api/chat requests to gzip-compressed JSONL files for `python replay.py`: arrival time, message sizes,
+# sampling parameters, outcome, token counts and the upstream token arrival timeline. Files are written by a
+# background task and named per process, so WORKERS may share CAPTURE_DIR.
+CAPTURE_ENABLED = False
+CAPTURE_DIR = "captures"                  # str: Directory for capture-*.jsonl.gz files
+CAPTURE_SAMPLE_RATE = 1.0                 # float: Fraction of chat requests captured
+CAPTURE_REDACT_CONTENT = True             # bool: Keep only message and answer sizes, False also stores the messages and answers
+CAPTURE_ROTATE_BYTES = 32 * 1024 * 1024   # int: Uncompressed bytes per file before a new one is started
+CAPTURE_MAX_FILES = 20                    # int: Oldest files beyond this count are deleted
+CAPTURE_MAX_PENDING = 10000               # int: Records waiting for the writer, further records are dropped
@@ -3,8 +3,36 @@ import asyncio
 import json
 from aiohttp import web
 from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import gzip
 import hashlib
-from typing import List, Dict, Any, Optional, Union
+import heapq
+import itertools
+import math
+import bisect
+import importlib
+import multiprocessing
+import os
+import random
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, Optional, Union, Tuple, Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # Load Configuration from config.py
 try:
@@ -18,9 +46,10 @@ def get_config_value(param_name: str, default_value: Any = None) -> Any:
 API_TOKEN: str = get_config_value("API_TOKEN")
 if not API_TOKEN or not isinstance(API_TOKEN, str):
     raise SystemExit("[Fatal Error] API_TOKEN is not defined, empty, or invalid in `config.py`.")
-API_URL: str = get_config_value("CHUTES_API_URL")
+API_URL: str = get_config_value("API_URL") or get_config_value("CHUTES_API_URL")
 MODEL_NAME: str = get_config_value("MODEL_NAME")
 SERVER_PORT: int = get_config_value("SERVER_PORT")
+SERVER_HOST: str = get_config_value("SERVER_HOST", "localhost")
 SYSTEM_PROMPT: Optional[str] = get_config_value("DEFAULT_SYSTEM_PROMPT")
 MAX_HISTORY_MESSAGES: int = get_config_value("MAX_HISTORY_MESSAGES")
 DEBUG_MODE: bool = get_config_value("DEBUG_MODE")
@@ -46,6 +75,68 @@ IGNORE_EOS: Optional[bool] = get_config_value("IGNORE_EOS")
 SKIP_SPECIAL_TOKENS: Optional[bool] = get_config_value("SKIP_SPECIAL_TOKENS")
 INCLUDE_STOP_STR_IN_OUTPUT: Optional[bool] = get_config_value("INCLUDE_STOP_STR_IN_OUTPUT")
 SPACES_BETWEEN_SPECIAL_TOKENS: Optional[bool] = get_config_value("SPACES_BETWEEN_SPECIAL_TOKENS")
+RESPONSE_CACHE_ENABLED: bool = get_config_value("RESPONSE_CACHE_ENABLED", False)
+RESPONSE_CACHE_MAX_BYTES: int = get_config_value("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+RESPONSE_CACHE_PERSIST_PATH: Optional[str] = get_config_value("RESPONSE_CACHE_PERSIST_PATH")
+RESPONSE_CACHE_REPLAY_DELAY: float = get_config_value("RESPONSE_CACHE_REPLAY_DELAY", 0.0)
+REQUEST_COALESCING_ENABLED: bool = get_config_value("REQUEST_COALESCING_ENABLED", True)
+STREAM_FLUSH_INTERVAL: float = get_config_value("STREAM_FLUSH_INTERVAL", 0.01)
+STREAM_FLUSH_MAX_CHARS: int = get_config_value("STREAM_FLUSH_MAX_CHARS", 4096)
+UPSTREAM_ENDPOINTS: List[Dict[str, Any]] = get_config_value("UPSTREAM_ENDPOINTS") or []
+UPSTREAM_MAX_ATTEMPTS: int = get_config_value("UPSTREAM_MAX_ATTEMPTS", 3)
+UPSTREAM_HEALTH_CHECK_INTERVAL: float = get_config_value("UPSTREAM_HEALTH_CHECK_INTERVAL", 30)
+UPSTREAM_CIRCUIT_FAILURE_THRESHOLD: int = get_config_value("UPSTREAM_CIRCUIT_FAILURE_THRESHOLD", 5)
+UPSTREAM_CIRCUIT_OPEN_SECONDS: float = get_config_value("UPSTREAM_CIRCUIT_OPEN_SECONDS", 30)
+UPSTREAM_MAX_CONCURRENCY: int = get_config_value("UPSTREAM_MAX_CONCURRENCY", 32)
+ADMISSION_CONTROL_ENABLED: bool = get_config_value("ADMISSION_CONTROL_ENABLED", True)
+ADMISSION_MAX_CONCURRENCY: int = get_config_value("ADMISSION_MAX_CONCURRENCY", 64)
+ADMISSION_MAX_QUEUE: int = get_config_value("ADMISSION_MAX_QUEUE", 256)
+ADMISSION_MAX_QUEUE_PER_CLIENT: int = get_config_value("ADMISSION_MAX_QUEUE_PER_CLIENT", 32)
+ADMISSION_QUEUE_TIMEOUT: float = get_config_value("ADMISSION_QUEUE_TIMEOUT", 30)
+ADMISSION_CLIENT_HEADER: Optional[str] = get_config_value("ADMISSION_CLIENT_HEADER", "X-Client-Id")
+ADMISSION_PRIORITY_HEADER: Optional[str] = get_config_value("ADMISSION_PRIORITY_HEADER", "X-Priority")
+ADMISSION_CLIENT_WEIGHTS: Dict[str, float] = get_config_value("ADMISSION_CLIENT_WEIGHTS") or {}
+ADMISSION_BATCH_CLIENTS: List[str] = get_config_value("ADMISSION_BATCH_CLIENTS") or []
+TOKEN_BUDGET_TRIMMING_ENABLED: bool = get_config_value("TOKEN_BUDGET_TRIMMING_ENABLED", False)
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = get_config_value("MODEL_CONTEXT_WINDOWS") or {}
+DEFAULT_CONTEXT_WINDOW: int = get_config_value("DEFAULT_CONTEXT_WINDOW", 32768)
+TOKEN_BUDGET_SAFETY_MARGIN: int = get_config_value("TOKEN_BUDGET_SAFETY_MARGIN", 64)
+TOKENIZER: Optional[Union[str, Callable[[str], int]]] = get_config_value("TOKENIZER")
+TOKEN_COUNT_CACHE_SIZE: int = get_config_value("TOKEN_COUNT_CACHE_SIZE", 10000)
+HEDGING_ENABLED: bool = get_config_value("HEDGING_ENABLED", False)
+HEDGE_TTFT_PERCENTILE: float = get_config_value("HEDGE_TTFT_PERCENTILE", 0.9)
+HEDGE_MIN_DELAY: float = get_config_value("HEDGE_MIN_DELAY", 0.25)
+HEDGE_DEFAULT_DELAY: float = get_config_value("HEDGE_DEFAULT_DELAY", 2.0)
+HEDGE_MAX_FRACTION: float = get_config_value("HEDGE_MAX_FRACTION", 0.1)
+UPSTREAM_CONNECT_TIMEOUT: Optional[float] = get_config_value("UPSTREAM_CONNECT_TIMEOUT", 10)
+UPSTREAM_FIRST_TOKEN_TIMEOUT: Optional[float] = get_config_value("UPSTREAM_FIRST_TOKEN_TIMEOUT")
+UPSTREAM_IDLE_TIMEOUT: Optional[float] = get_config_value("UPSTREAM_IDLE_TIMEOUT")
+STREAM_CONTINUATION_ENABLED: bool = get_config_value("STREAM_CONTINUATION_ENABLED", False)
+STREAM_CONTINUATION_MAX_RETRIES: int = get_config_value("STREAM_CONTINUATION_MAX_RETRIES", 2)
+STREAM_CONTINUATION_MODE: str = get_config_value("STREAM_CONTINUATION_MODE", "assistant_prefix")
+STREAM_CONTINUATION_PROMPT: str = get_config_value("STREAM_CONTINUATION_PROMPT", "Continue exactly where you stopped. Do not repeat anything.")
+STREAM_CONTINUATION_PREFIX_PARAMS: Dict[str, Any] = get_config_value("STREAM_CONTINUATION_PREFIX_PARAMS", {"continue_final_message": True, "add_generation_prompt": False})
+EMBEDDING_MODEL_NAME: Optional[str] = get_config_value("EMBEDDING_MODEL_NAME")
+EMBEDDINGS_API_URL: Optional[str] = get_config_value("EMBEDDINGS_API_URL")
+EMBEDDING_BATCH_MAX_SIZE: int = get_config_value("EMBEDDING_BATCH_MAX_SIZE", 64)
+EMBEDDING_BATCH_MAX_WAIT: float = get_config_value("EMBEDDING_BATCH_MAX_WAIT", 0.005)
+EMBEDDING_CACHE_SIZE: int = get_config_value("EMBEDDING_CACHE_SIZE", 0)
+WORKERS: int = get_config_value("WORKERS", 1)
+USE_UVLOOP: bool = get_config_value("USE_UVLOOP", True)
+WORKER_SHUTDOWN_TIMEOUT: float = get_config_value("WORKER_SHUTDOWN_TIMEOUT", 30)
+WORKER_METRICS_INTERVAL: float = get_config_value("WORKER_METRICS_INTERVAL", 2)
+MODEL_CATALOG_ENABLED: bool = get_config_value("MODEL_CATALOG_ENABLED", True)
+MODEL_CATALOG_TTL: float = get_config_value("MODEL_CATALOG_TTL", 300)
+MODEL_CATALOG_RETRY_INTERVAL: float = get_config_value("MODEL_CATALOG_RETRY_INTERVAL", 30)
+MODEL_CATALOG_REJECT_UNKNOWN: bool = get_config_value("MODEL_CATALOG_REJECT_UNKNOWN", True)
+MODEL_ALIASES: Dict[str, str] = get_config_value("MODEL_ALIASES") or {}
+CAPTURE_ENABLED: bool = get_config_value("CAPTURE_ENABLED", False)
+CAPTURE_DIR: str = get_config_value("CAPTURE_DIR", "captures")
+CAPTURE_SAMPLE_RATE: float = get_config_value("CAPTURE_SAMPLE_RATE", 1.0)
+CAPTURE_REDACT_CONTENT: bool = get_config_value("CAPTURE_REDACT_CONTENT", True)
+CAPTURE_ROTATE_BYTES: int = get_config_value("CAPTURE_ROTATE_BYTES", 32 * 1024 * 1024)
+CAPTURE_MAX_FILES: int = get_config_value("CAPTURE_MAX_FILES", 20)
+CAPTURE_MAX_PENDING: int = get_config_value("CAPTURE_MAX_PENDING", 10000)
 
 SPECIFIC_SYSTEM_PROMPT_TO_IGNORE = " Ex)You are a helpful assistant "
 if SYSTEM_PROMPT == SPECIFIC_SYSTEM_PROMPT_TO_IGNORE:
@@ -76,10 +167,48 @@ for model_def_script in _ADVERTISED_MODEL_DEFINITIONS_IN_SCRIPT:
 PROXY_VERSION: str = "0.2.2-chutesai-proxy"
 
 
-LLM_SSE_EVENT_PREFIX: str = "data: "
-LLM_SSE_DONE_PAYLOAD: str = "[DONE]"
+LLM_SSE_DATA_FIELD: bytes = b"data:"
+LLM_SSE_DONE_PAYLOAD: bytes = b"[DONE]"
+LLM_CONTENT_MARKERS: Tuple[bytes, ...] = (b'"content":"', b'"content": "')
+LLM_EMPTY_CONTENT_MARKERS: Tuple[bytes, ...] = (b'"content":""', b'"content": ""')
 
 # Helper Functions
+if orjson is not None:
+    _json_loads = orjson.loads
+    _json_dumps_bytes = orjson.dumps
+else:
+    _json_loads = json.loads
+    def _json_dumps_bytes(obj: Any) -> bytes: return json.dumps(obj).encode('utf-8')
+
+class _SSEByteParser:
+    """Incremental SSE parser working on raw network chunks. Returns the `data:` payloads of complete lines as bytes."""
+    def __init__(self):
+        self._buffer = b""
+
+    def feed(self, data: bytes) -> List[bytes]:
+        if self._buffer: data = self._buffer + data
+        lines = data.split(b"\n"); self._buffer = lines.pop()
+        return [line[len(LLM_SSE_DATA_FIELD):].strip() for line in lines if line.startswith(LLM_SSE_DATA_FIELD)]
+
+    def flush(self) -> List[bytes]:
+        """Payload of a last line the backend ended without a newline."""
+        last_line, self._buffer = self._buffer, b""
+        return [last_line[len(LLM_SSE_DATA_FIELD):].strip()] if last_line.startswith(LLM_SSE_DATA_FIELD) else []
+
+class _OllamaChunkEncoder:
+    """Prebuilt NDJSON template for streamed Ollama chat chunks, only the content is escaped and inserted per chunk."""
+    def __init__(self, chunk_model: str):
+        self._head = b'{"model":' + _json_dumps_bytes(chunk_model) + b',"created_at":"'
+        self._middle = b'","message":{"role":"assistant","content":'
+        self._tail = b'},"done":false}\n'
+
+    def encode(self, content: str) -> bytes:
+        created_at = datetime.now(timezone.utc).isoformat().encode('ascii')
+        return b"".join((self._head, created_at, self._middle, _json_dumps_bytes(content), self._tail))
+
+def _resolve_waiter(waiter: asyncio.Future) -> None:
+    if not waiter.done(): waiter.set_result(None)
+
 def _build_backend_llm_request_body(
         chutes_ai_model_name: str,
         processed_messages: List[Dict[str, str]],
@@ -155,55 +284,1663 @@ def _build_backend_llm_request_body(
         if client_sent_tool_params: print("[DEBUG] Client sent tool/function calling parameters. This proxy currently ignores them as backend support is unconfirmed via schema.")
     return final_body
 
+# Metrics
+LATENCY_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+INTER_TOKEN_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+TOKENS_PER_SECOND_BUCKETS: Tuple[float, ...] = (1, 5, 10, 20, 35, 50, 75, 100, 150, 250, 500, 1000)
+BATCH_SIZE_BUCKETS: Tuple[float, ...] = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+class _MetricFamily:
+    metric_type: str = "untyped"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()):
+        self.name = name; self.help_text = help_text; self.label_names = label_names
+        self._series: Dict[Tuple[str, ...], Any] = {}
+
+    def _format_labels(self, label_values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{label_name}="{_escape_label_value(label_value)}"' for label_name, label_value in zip(self.label_names, label_values)]
+        if extra: pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _snapshot_value(self, value: Any) -> Any:
+        return value
+
+    def _merge_values(self, value: Any, other_value: Any) -> Any:
+        return value + other_value
+
+    def snapshot(self) -> List[List[Any]]:
+        """JSON-serializable copy of every series, used to share metrics between worker processes."""
+        return [[list(label_values), self._snapshot_value(value)] for label_values, value in self._series.items()]
+
+    def merged_series(self, worker_snapshots: List[Dict[str, Any]]) -> Dict[Tuple[str, ...], Any]:
+        merged = {label_values: self._snapshot_value(value) for label_values, value in self._series.items()}
+        for worker_snapshot in worker_snapshots:
+            for label_values, value in worker_snapshot.get(self.name, ()):
+                label_values = tuple(label_values)
+                merged[label_values] = self._merge_values(merged[label_values], value) if label_values in merged else value
+        return merged
+
+    def render(self, series: Dict[Tuple[str, ...], Any]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_values, value in sorted(series.items()):
+            lines.append(f"{self.name}{self._format_labels(label_values)} {_format_metric_value(value)}")
+        return lines
+
+class Counter(_MetricFamily):
+    metric_type = "counter"
+
+    def inc(self, label_values: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self._series[label_values] = self._series.get(label_values, 0) + amount
+
+class Gauge(_MetricFamily):
+    metric_type = "gauge"
+
+    def inc(self, label_values: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def dec(self, label_values: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self._series[label_values] = self._series.get(label_values, 0) - amount
+
+class _HistogramSeries:
+    __slots__ = ("buckets", "bucket_counts", "total", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets; self.bucket_counts = [0] * (len(buckets) + 1); self.total = 0.0; self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value; self.count += 1
+
+class Histogram(_MetricFamily):
+    """Histogram with fixed buckets. Each label combination gets its bucket array once, so observing
+    a value is a bisect and three increments."""
+    metric_type = "histogram"
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = buckets
+
+    def series(self, label_values: Tuple[str, ...] = ()) -> _HistogramSeries:
+        histogram_series = self._series.get(label_values)
+        if histogram_series is None: histogram_series = self._series[label_values] = _HistogramSeries(self.buckets)
+        return histogram_series
+
+    def observe(self, label_values: Tuple[str, ...], value: float) -> None:
+        self.series(label_values).observe(value)
+
+    def _snapshot_value(self, histogram_series: _HistogramSeries) -> List[Any]:
+        return [list(histogram_series.bucket_counts), histogram_series.total, histogram_series.count]
+
+    def _merge_values(self, value: List[Any], other_value: List[Any]) -> List[Any]:
+        return [[bucket_count + other_count for bucket_count, other_count in zip(value[0], other_value[0])], value[1] + other_value[1], value[2] + other_value[2]]
+
+    def render(self, series: Dict[Tuple[str, ...], Any]) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        for label_values, (bucket_counts, total, count) in sorted(series.items()):
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative_count += bucket_count
+                le_label = 'le="+Inf"' if upper_bound == float("inf") else f'le="{_format_metric_value(upper_bound)}"'
+                lines.append(f"{self.name}_bucket{self._format_labels(label_values, le_label)} {cumulative_count}")
+            lines.append(f"{self.name}_sum{self._format_labels(label_values)} {_format_metric_value(total)}")
+            lines.append(f"{self.name}_count{self._format_labels(label_values)} {count}")
+        return lines
+
+def _escape_label_value(label_value: Any) -> str:
+    return str(label_value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_metric_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class ProxyMetrics:
+    """All metrics exported on /metrics, broken down by model and upstream where it applies."""
+
+    def __init__(self):
+        model_upstream = ("model", "upstream")
+        self.request_to_connect = Histogram("proxy_request_to_upstream_connect_seconds", "Time from parsing the client request to receiving upstream response headers.", model_upstream)
+        self.upstream_ttfb = Histogram("proxy_upstream_ttfb_seconds", "Time from sending the upstream request to its first body byte.", model_upstream)
+        self.upstream_ttft = Histogram("proxy_upstream_ttft_seconds", "Time from sending the upstream request to its first content token.", model_upstream)
+        self.inter_token_latency = Histogram("proxy_inter_token_seconds", "Time between consecutive upstream content tokens.", model_upstream, INTER_TOKEN_BUCKETS)
+        self.tokens_per_second = Histogram("proxy_tokens_per_second", "Upstream content tokens per second after the first token.", model_upstream, TOKENS_PER_SECOND_BUCKETS)
+        self.request_duration = Histogram("proxy_request_duration_seconds", "Total time spent serving a client chat request.", model_upstream)
+        self.bytes_in = Counter("proxy_upstream_bytes_received_total", "Bytes received from upstream response bodies.", model_upstream)
+        self.bytes_out = Counter("proxy_client_bytes_sent_total", "Bytes of chat responses written to clients.", ("model",))
+        self.client_streams_in_flight = Gauge("proxy_client_streams_in_flight", "Client chat responses currently being served.", ("model",))
+        self.upstream_in_flight = Gauge("proxy_upstream_requests_in_flight", "Upstream requests currently open.", ("upstream",))
+        self.upstream_responses = Counter("proxy_upstream_responses_total", "Upstream responses by HTTP status, or \"error\" for connection failures.", ("upstream", "status"))
+        self.usage_tokens = Counter("proxy_usage_tokens_total", "Prompt and completion tokens reported in upstream usage.", ("model", "upstream", "type"))
+        self.embedding_batch_size = Histogram("proxy_embedding_batch_size", "Texts per upstream embeddings request.", ("model",), BATCH_SIZE_BUCKETS)
+        self.client_disconnects = Counter("proxy_client_disconnects_total", "Clients that disconnected before their response was complete.", ("model",))
+        self.stream_continuations = Counter("proxy_stream_continuations_total", "Continuation requests sent after a chat stream broke mid-answer.", model_upstream)
+        self.stream_recoveries = Counter("proxy_stream_recoveries_total", "Chat streams that broke mid-answer, by outcome: recovered, failed, or disabled (continuation off).", ("model", "outcome"))
+
+    def families(self) -> List[_MetricFamily]:
+        return [metric_family for metric_family in vars(self).values() if isinstance(metric_family, _MetricFamily)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {metric_family.name: metric_family.snapshot() for metric_family in self.families()}
+
+    def render(self, worker_snapshots: List[Dict[str, Any]] = ()) -> str:
+        """Renders this process's metrics, summed with the snapshots of the other worker processes if given."""
+        lines: List[str] = []
+        for metric_family in self.families(): lines.extend(metric_family.render(metric_family.merged_series(worker_snapshots)))
+        return "\n".join(lines) + "\n"
+
+PROXY_METRICS = ProxyMetrics()
+
+METRIC_OTHER_MODEL_LABEL: str = "other"
+_metric_model_names: Optional[set] = None
+
+def _known_metric_model_names() -> set:
+    global _metric_model_names
+    if _metric_model_names is None:
+        _metric_model_names = {MODEL_NAME, EMBEDDING_MODEL_NAME, *MODEL_CONTEXT_WINDOWS, *MODEL_ALIASES, *MODEL_ALIASES.values()}
+        _metric_model_names.update(_backend_model_name(model_def["name"]) for model_def in PROXY_ADVERTISED_MODELS)
+        for endpoint_conf in UPSTREAM_ENDPOINTS:
+            _metric_model_names.update(endpoint_conf.get("models") or ()); _metric_model_names.update(endpoint_conf.get("embedding_models") or ())
+            _metric_model_names.update(endpoint_conf.get("model_map") or {})
+        _metric_model_names.discard(None)
+    return _metric_model_names
+
+def _register_metric_model_names(model_names: List[str]) -> None:
+    """Gives models listed by the upstreams their own metric series."""
+    _known_metric_model_names().update(model_names)
+
+def _metric_model_label(model: str) -> str:
+    """Model label for metrics. Only configured or upstream-listed models get their own series, so clients
+    sending arbitrary model names cannot create unbounded label sets; everything else is counted as "other"."""
+    return model if model in _known_metric_model_names() else METRIC_OTHER_MODEL_LABEL
+
+class _UpstreamAttemptObserver:
+    """Records the per-stage timings of one upstream attempt. The histogram series are looked up once,
+    so the per-token cost is a clock read and one histogram observation."""
+    __slots__ = ("labels", "request_started_at", "started_at", "first_byte_at", "first_token_at", "last_token_at",
+                 "tokens", "bytes_in", "first_token_timed_out", "_inter_token_series", "_first_token_timer")
+
+    def __init__(self, model: str, upstream: str, request_started_at: float):
+        self.labels = (_metric_model_label(model), upstream); self.request_started_at = request_started_at
+        self.started_at = time.monotonic()
+        self.first_byte_at: Optional[float] = None; self.first_token_at: Optional[float] = None; self.last_token_at = 0.0
+        self.tokens = 0; self.bytes_in = 0
+        self.first_token_timed_out = False; self._first_token_timer: Optional[asyncio.TimerHandle] = None
+        self._inter_token_series = PROXY_METRICS.inter_token_latency.series(self.labels)
+
+    def arm_first_token_timeout(self, timeout: float) -> None:
+        """Cancels the current task if no content token arrives within `timeout` seconds. The caller tells this
+        cancellation apart from others by `first_token_timed_out`."""
+        attempt_task = asyncio.current_task()
+        def expire() -> None:
+            self.first_token_timed_out = True; attempt_task.cancel()
+        self._first_token_timer = asyncio.get_running_loop().call_later(timeout, expire)
+
+    def on_connected(self) -> None:
+        PROXY_METRICS.request_to_connect.observe(self.labels, time.monotonic() - self.request_started_at)
+
+    def on_chunk(self, chunk_size: int) -> None:
+        if self.first_byte_at is None:
+            self.first_byte_at = time.monotonic(); PROXY_METRICS.upstream_ttfb.observe(self.labels, self.first_byte_at - self.started_at)
+        self.bytes_in += chunk_size
+
+    def on_token(self, token_count: int = 1) -> None:
+        now = time.monotonic()
+        if self.first_token_at is None:
+            self.first_token_at = now; PROXY_METRICS.upstream_ttft.observe(self.labels, now - self.started_at)
+            if self._first_token_timer is not None: self._first_token_timer.cancel()
+        else: self._inter_token_series.observe(now - self.last_token_at)
+        self.last_token_at = now; self.tokens += token_count
+
+    def ttft(self) -> Optional[float]:
+        return self.first_token_at - self.started_at if self.first_token_at is not None else None
+
+    def on_finished(self) -> None:
+        if self._first_token_timer is not None: self._first_token_timer.cancel()
+        PROXY_METRICS.bytes_in.inc(self.labels, self.bytes_in)
+        if self.first_token_at is not None and self.tokens > 1 and self.last_token_at > self.first_token_at:
+            PROXY_METRICS.tokens_per_second.observe(self.labels, (self.tokens - 1) / (self.last_token_at - self.first_token_at))
+
+class _SharedUpstreamStream:
+    """Fan-out buffer for one upstream generation. Every attached client first receives the
+    tokens produced so far, then follows the live tail until the upstream finishes."""
+
+    def __init__(self, request_key: str, request_started_at: float):
+        self.request_key = request_key; self.request_started_at = request_started_at; self.started_at = time.monotonic()
+        self.upstream_name = "none"
+        self.token_times: Optional[List[float]] = None  # Arrival time per content part, recorded for traffic capture
+        self.content_parts: List[str] = []; self.content_chars = 0; self.chunk_model: Optional[str] = None
+        self.last_backend_payload: Dict[str, Any] = {}; self.error: Optional[str] = None
+        self.done = False; self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._char_waiters: List[tuple[int, asyncio.Future]] = []
+        self._finished = asyncio.Event()
+
+    def publish(self, content_token: str, chunk_model: Optional[str]) -> None:
+        self.content_parts.append(content_token); self.content_chars += len(content_token)
+        if self.token_times is not None: self.token_times.append(time.monotonic())
+        if chunk_model: self.chunk_model = chunk_model
+        for min_total_chars, waiter in self._char_waiters:
+            if self.content_chars >= min_total_chars: _resolve_waiter(waiter)
+
+    def finish(self, last_backend_payload: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        if self.done: return
+        if last_backend_payload is not None: self.last_backend_payload = last_backend_payload
+        self.error = error; self.done = True
+        for _, waiter in self._char_waiters: _resolve_waiter(waiter)
+        self._finished.set()
+
+    async def wait_for_chars(self, min_total_chars: int, timeout: Optional[float] = None) -> None:
+        """Returns once `min_total_chars` characters were published in total, the stream is done, or `timeout` seconds passed."""
+        if self.content_chars >= min_total_chars or self.done: return
+        loop = asyncio.get_running_loop()
+        waiter_entry = (min_total_chars, loop.create_future()); self._char_waiters.append(waiter_entry)
+        timer = loop.call_later(timeout, _resolve_waiter, waiter_entry[1]) if timeout is not None else None
+        try: await waiter_entry[1]
+        finally:
+            if timer is not None: timer.cancel()
+            self._char_waiters.remove(waiter_entry)
+
+    async def wait_until_done(self) -> None:
+        await self._finished.wait()
+
+    def attach(self) -> None:
+        self.subscribers += 1
+
+    def detach(self) -> None:
+        self.subscribers -= 1
+        if self.subscribers <= 0 and not self.done and self.task is not None:
+            if DEBUG_MODE: print(f"[DEBUG] Last client detached from upstream {self.request_key[:16]}, cancelling it.")
+            self.task.cancel()
+
 async def _transform_and_stream_llm_response(
-        llm_backend_response: aiohttp.ClientResponse, client_web_response: web.StreamResponse,
-        client_model_requested: str, stream_to_client: bool
-) -> tuple[str, Dict[str, Any]]:
+        llm_backend_response: aiohttp.ClientResponse, shared_stream: Union[_SharedUpstreamStream, "_HedgedAttemptSink"],
+        observer: Optional[_UpstreamAttemptObserver] = None
+) -> tuple[List[str], Dict[str, Any]]:
+    """Publishes the content tokens of one backend SSE stream. Raises ClientPayloadError if the stream ends
+    without [DONE] or a finish reason, so a silently truncated answer is handled like a dropped connection."""
     content_parts: List[str] = []; last_backend_payload: Dict[str, Any] = {}
-    async for line_bytes in llm_backend_response.content:
-        line = line_bytes.decode("utf-8").strip()
-        if not line.startswith(LLM_SSE_EVENT_PREFIX): continue
-        data_json_str = line[len(LLM_SSE_EVENT_PREFIX):].strip()
-        if data_json_str == LLM_SSE_DONE_PAYLOAD: break
-        if not data_json_str: continue
+    sse_parser = _SSEByteParser()
+    while True:
+        raw_chunk = await llm_backend_response.content.readany()
+        if raw_chunk:
+            if observer is not None: observer.on_chunk(len(raw_chunk))
+            data_payloads = sse_parser.feed(raw_chunk)
+        else: data_payloads = sse_parser.flush()
+        for data_payload in data_payloads:
+            if data_payload == LLM_SSE_DONE_PAYLOAD: return content_parts, last_backend_payload
+            if not data_payload: continue
+            try:
+                backend_payload = _json_loads(data_payload); last_backend_payload = backend_payload
+                choices = backend_payload.get("choices")
+                if not (choices and isinstance(choices, list) and choices): continue
+                content_token = choices[0].get("delta", {}).get("content")
+                if content_token:
+                    if observer is not None: observer.on_token()
+                    content_parts.append(content_token)
+                    shared_stream.publish(content_token, backend_payload.get("model"))
+                if choices[0].get("finish_reason") is not None: return content_parts, last_backend_payload
+            except ValueError: print(f"[Error] Ollama Proxy: Failed to parse JSON chunk from backend: {data_payload[:200]!r}")
+            except Exception as e_chunk_proc: print(f"[Error] Ollama Proxy: Error processing backend chunk: {e_chunk_proc}, data: {data_payload[:200]!r}")
+        if not raw_chunk: break
+    raise aiohttp.ClientPayloadError("Backend stream ended before a finish reason or [DONE].")
+
+async def _run_shared_upstream(
+        app: web.Application, backend_llm_body: Dict[str, Any],
+        shared_stream: _SharedUpstreamStream, cache_key: Optional[str]
+) -> None:
+    """Runs one backend request to completion, independent of the client that started it.
+    Fails over to the next upstream endpoint as long as no token has been published yet, and after that
+    continues a broken stream from its partial answer if STREAM_CONTINUATION_ENABLED."""
+    upstream_pool: UpstreamPool = app['upstream_pool']
+    try:
+        candidates = upstream_pool.candidates(backend_llm_body["model"])[:UPSTREAM_MAX_ATTEMPTS]
+        if not candidates:
+            shared_stream.finish(error="No upstream endpoint is currently available for this model."); return
+        hedge_controller: Optional[HedgeController] = app.get('hedge_controller')
+        if hedge_controller is not None:
+            attempt_error, retryable, used_endpoints = await _race_hedged_attempts(app, hedge_controller, candidates, backend_llm_body, shared_stream)
+            candidates = [endpoint for endpoint in candidates if endpoint not in used_endpoints]
+            if attempt_error is None or not retryable or shared_stream.content_parts: candidates = []
+        for endpoint in candidates:
+            attempt_error, retryable = await _attempt_upstream(app, endpoint, backend_llm_body, shared_stream)
+            if attempt_error is None or not retryable or shared_stream.content_parts: break
+            if DEBUG_MODE: print(f"[DEBUG] Upstream '{endpoint.name}' failed before the first token, trying the next endpoint.")
+        if attempt_error is not None and retryable and shared_stream.content_parts:
+            attempt_error = await _continue_interrupted_stream(app, backend_llm_body, shared_stream, attempt_error)
+        if attempt_error is not None:
+            shared_stream.finish(error=attempt_error); return
+        response_cache: Optional[ResponseCache] = app.get('response_cache')
+        if cache_key is not None and response_cache is not None and _backend_response_finished(shared_stream.last_backend_payload):
+            response_cache.put(cache_key, shared_stream.content_parts, shared_stream.chunk_model, shared_stream.last_backend_payload.get("usage"))
+        shared_stream.finish()
+    except asyncio.CancelledError:
+        shared_stream.finish(error="Upstream request was cancelled."); raise
+    except Exception as e_upstream:
+        error_message = f"Unhandled server error: {str(e_upstream)}"; print(f"[Error] Ollama Proxy Upstream: {error_message}")
+        shared_stream.finish(error=error_message)
+    finally:
+        inflight_streams: Dict[str, _SharedUpstreamStream] = app['inflight_streams']
+        if inflight_streams.get(shared_stream.request_key) is shared_stream: del inflight_streams[shared_stream.request_key]
+
+async def _attempt_upstream(
+        app: web.Application, endpoint: "UpstreamEndpoint",
+        backend_llm_body: Dict[str, Any], shared_stream: Union[_SharedUpstreamStream, "_HedgedAttemptSink"]
+) -> tuple[Optional[str], bool]:
+    """Streams one backend request from `endpoint` into the shared stream.
+    Returns (None, False) on success, otherwise the error message and whether another endpoint may succeed."""
+    endpoint_body = dict(backend_llm_body, model=endpoint.backend_model(backend_llm_body["model"]))
+    observer = _UpstreamAttemptObserver(backend_llm_body["model"], endpoint.name, shared_stream.request_started_at)
+    shared_stream.upstream_name = endpoint.name
+    endpoint.acquire(); PROXY_METRICS.upstream_in_flight.inc((endpoint.name,))
+    if UPSTREAM_FIRST_TOKEN_TIMEOUT: observer.arm_first_token_timeout(UPSTREAM_FIRST_TOKEN_TIMEOUT)
+    try:
+        async with app['aiohttp_session'].post(endpoint.url, json=endpoint_body, headers=endpoint.auth_headers(), timeout=UPSTREAM_REQUEST_TIMEOUT) as llm_backend_response:
+            observer.on_connected(); PROXY_METRICS.upstream_responses.inc((endpoint.name, str(llm_backend_response.status)))
+            if llm_backend_response.status != 200:
+                error_text = await llm_backend_response.text()
+                print(f"[Error] Backend LLM API Error ({endpoint.name}) - Status: {llm_backend_response.status}, Response: {error_text}")
+                retryable = _record_upstream_error_status(endpoint, llm_backend_response.status, llm_backend_response.headers)
+                return f"Backend LLM Error (Status {llm_backend_response.status}): {error_text[:200]}", retryable
+            endpoint.observe_rate_limit_headers(llm_backend_response.headers)
+            _, last_backend_payload = await _transform_and_stream_llm_response(llm_backend_response, shared_stream, observer)
+            shared_stream.last_backend_payload = last_backend_payload
+            _record_usage(backend_llm_body["model"], endpoint.name, last_backend_payload.get("usage"))
+            endpoint.record_success(observer.ttft())
+            if observer.first_token_at is not None and app.get('hedge_controller') is not None: app['hedge_controller'].record_ttft(observer.ttft())
+            return None, False
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e_connection:
+        endpoint.record_failure()
+        if observer.first_byte_at is None: PROXY_METRICS.upstream_responses.inc((endpoint.name, "error"))
+        print(f"[Error] Backend LLM connection error ({endpoint.name}): {type(e_connection).__name__}: {e_connection}")
+        return f"Backend LLM connection error: {str(e_connection) or type(e_connection).__name__}", True
+    except asyncio.CancelledError:
+        if not observer.first_token_timed_out or not _withdraw_own_cancellation(): raise
+        endpoint.record_failure()
+        if observer.first_byte_at is None: PROXY_METRICS.upstream_responses.inc((endpoint.name, "error"))
+        print(f"[Error] Backend LLM sent no token within {UPSTREAM_FIRST_TOKEN_TIMEOUT}s ({endpoint.name}).")
+        return f"Backend LLM sent no token within {UPSTREAM_FIRST_TOKEN_TIMEOUT}s", True
+    finally:
+        endpoint.release(); PROXY_METRICS.upstream_in_flight.dec((endpoint.name,))
+        observer.on_finished()
+
+def _withdraw_own_cancellation() -> bool:
+    """Takes back a cancellation the current task requested on itself. Returns False if another cancellation
+    is pending as well (only detectable on Python 3.11+), in which case it must propagate."""
+    current_task = asyncio.current_task()
+    return not hasattr(current_task, "uncancel") or current_task.uncancel() == 0
+
+def _build_continuation_body(backend_llm_body: Dict[str, Any], partial_content: str, continuation_mode: str) -> Dict[str, Any]:
+    """Request body that asks the backend to go on from `partial_content`, either as a trailing assistant
+    message to extend ("assistant_prefix") or followed by a user turn asking to continue ("continue_turn")."""
+    continuation_messages = list(backend_llm_body["messages"]) + [{"role": "assistant", "content": partial_content}]
+    continuation_body = dict(backend_llm_body, messages=continuation_messages)
+    if continuation_mode == "continue_turn": continuation_messages.append({"role": "user", "content": STREAM_CONTINUATION_PROMPT})
+    else: continuation_body.update(STREAM_CONTINUATION_PREFIX_PARAMS)
+    if isinstance(backend_llm_body.get("max_tokens"), int):
+        continuation_body["max_tokens"] = max(backend_llm_body["max_tokens"] - _heuristic_token_count(partial_content), 1)
+    return continuation_body
+
+async def _continue_interrupted_stream(
+        app: web.Application, backend_llm_body: Dict[str, Any], shared_stream: _SharedUpstreamStream, attempt_error: str
+) -> Optional[str]:
+    """Recovers a stream that broke after content was published by re-sending the request with the partial
+    answer, up to STREAM_CONTINUATION_MAX_RETRIES times. New tokens are published into the same shared
+    stream, so attached clients see one uninterrupted answer. Returns the remaining error, None if recovered."""
+    metric_model = _metric_model_label(backend_llm_body["model"])
+    if not STREAM_CONTINUATION_ENABLED:
+        PROXY_METRICS.stream_recoveries.inc((metric_model, "disabled")); return attempt_error
+    upstream_pool: UpstreamPool = app['upstream_pool']
+    for continuation_number in range(1, STREAM_CONTINUATION_MAX_RETRIES + 1):
+        candidates = [endpoint for endpoint in upstream_pool.candidates(backend_llm_body["model"]) if endpoint.continuation_mode != "none"]
+        if not candidates: break
+        endpoint = candidates[0]
+        if DEBUG_MODE: print(f"[DEBUG] Stream broke after {shared_stream.content_chars} chars ({attempt_error}), continuation {continuation_number} via '{endpoint.name}'.")
+        PROXY_METRICS.stream_continuations.inc((metric_model, endpoint.name))
+        continuation_body = _build_continuation_body(backend_llm_body, "".join(shared_stream.content_parts), endpoint.continuation_mode)
+        attempt_error, retryable = await _attempt_upstream(app, endpoint, continuation_body, shared_stream)
+        if attempt_error is None:
+            PROXY_METRICS.stream_recoveries.inc((metric_model, "recovered")); return None
+        if not retryable: break
+    PROXY_METRICS.stream_recoveries.inc((metric_model, "failed"))
+    return attempt_error
+
+def _record_upstream_error_status(endpoint: "UpstreamEndpoint", status: int, headers: Any) -> bool:
+    """Updates the endpoint's health for a non-200 response. Returns whether another endpoint may succeed."""
+    retryable = status in UPSTREAM_RETRYABLE_STATUSES
+    retry_after = _parse_retry_after(headers.get("Retry-After"))
+    if status == 429 or (status == 503 and retry_after is not None): endpoint.record_rate_limit(retry_after)
+    elif retryable: endpoint.record_failure()
+    else: endpoint.record_success(None)
+    return retryable
+
+def _record_usage(model: str, upstream: str, usage_info: Any) -> None:
+    if not isinstance(usage_info, dict): return
+    for usage_key, token_type in (("prompt_tokens", "prompt"), ("completion_tokens", "completion")):
+        if isinstance(usage_info.get(usage_key), int): PROXY_METRICS.usage_tokens.inc((_metric_model_label(model), upstream, token_type), usage_info[usage_key])
+
+async def _relay_shared_stream_to_client(
+        shared_stream: _SharedUpstreamStream, client_web_response: web.StreamResponse,
+        client_model_requested: str, stream_to_client: bool
+) -> None:
+    """Writes the shared stream to one client. Tokens arriving within STREAM_FLUSH_INTERVAL of the previous
+    write are coalesced into a single chunk, while a token after an idle gap is written immediately."""
+    if stream_to_client:
+        loop = asyncio.get_running_loop()
+        chunk_encoder: Optional[_OllamaChunkEncoder] = None
+        position = 0; flushed_chars = 0; last_flush_at = float("-inf")
+        while True:
+            await shared_stream.wait_for_chars(flushed_chars + 1)
+            if position >= len(shared_stream.content_parts): break
+            flush_deadline = last_flush_at + STREAM_FLUSH_INTERVAL
+            if not shared_stream.done and loop.time() < flush_deadline:
+                await shared_stream.wait_for_chars(flushed_chars + STREAM_FLUSH_MAX_CHARS, flush_deadline - loop.time())
+            new_parts = shared_stream.content_parts[position:]
+            position += len(new_parts); flushed_chars = shared_stream.content_chars
+            if chunk_encoder is None: chunk_encoder = _OllamaChunkEncoder(shared_stream.chunk_model or client_model_requested)
+            encoded_chunk = chunk_encoder.encode("".join(new_parts))
+            await client_web_response.write(encoded_chunk)
+            PROXY_METRICS.bytes_out.inc((_metric_model_label(_backend_model_name(client_model_requested)),), len(encoded_chunk))
+            last_flush_at = loop.time()
+    else:
+        await shared_stream.wait_until_done()
+    if shared_stream.error is not None:
+        ollama_final_obj = {"model": client_model_requested, "created_at": datetime.now(timezone.utc).isoformat(),
+                            "message": {"role": "assistant", "content": ""}, "done": True, "error": shared_stream.error[:200]}
+    else:
+        full_assistant_content = "".join(shared_stream.content_parts)
+        ollama_final_obj = _build_ollama_final_obj(client_model_requested, "" if stream_to_client else full_assistant_content, shared_stream.last_backend_payload.get("usage"))
+    final_bytes = json.dumps(ollama_final_obj).encode('utf-8') + (b'\n' if stream_to_client else b'')
+    await client_web_response.write(final_bytes)
+    PROXY_METRICS.bytes_out.inc((_metric_model_label(_backend_model_name(client_model_requested)),), len(final_bytes))
+
+def _build_ollama_final_obj(client_model_requested: str, final_content: str, usage_info: Any) -> Dict[str, Any]:
+    ollama_final_obj: Dict[str, Any] = {"model": client_model_requested, "created_at": datetime.now(timezone.utc).isoformat(),
+                                        "message": {"role": "assistant", "content": final_content},
+                                        "done": True }
+    if isinstance(usage_info, dict):
+        if usage_info.get("prompt_tokens") is not None: ollama_final_obj["prompt_eval_count"] = usage_info.get("prompt_tokens")
+        if usage_info.get("completion_tokens") is not None: ollama_final_obj["eval_count"] = usage_info.get("completion_tokens")
+        if usage_info.get("total_tokens") is not None: ollama_final_obj["total_tokens_backend"] = usage_info.get("total_tokens")
+    return ollama_final_obj
+
+def _backend_model_name(client_model_requested: str) -> str:
+    if ":" in client_model_requested and client_model_requested.endswith(":latest"): return client_model_requested[:-len(":latest")]
+    return client_model_requested
+
+def _ollama_response_headers(stream_to_client: bool) -> Dict[str, str]:
+    response_headers = {'Cache-Control': 'no-cache', 'Connection': 'keep-alive'}
+    if stream_to_client: response_headers['Content-Type'] = 'application/x-ndjson'
+    else: response_headers['Content-Type'] = 'application/json'
+    return response_headers
+
+# OpenAI-compatible Passthrough
+class _PassthroughRelay:
+    """Client side of one /v1/chat/completions request. The client response is prepared when the first
+    upstream body byte arrives, so the request can still fail over to another endpoint until then."""
+    __slots__ = ("request", "client_response", "upstream_name", "bytes_out", "error_status", "error_body", "error_content_type")
+
+    def __init__(self, request: web.Request):
+        self.request = request; self.client_response: Optional[web.StreamResponse] = None
+        self.upstream_name = "none"; self.bytes_out = 0
+        self.error_status: Optional[int] = None; self.error_body = b""; self.error_content_type = "application/json"
+
+    async def prepare(self, content_type: Optional[str]) -> None:
+        self.client_response = web.StreamResponse(status=200, headers={"Content-Type": content_type or "text/event-stream", "Cache-Control": "no-cache"})
+        await self.client_response.prepare(self.request)
+
+    async def write(self, chunk: bytes) -> None:
+        await self.client_response.write(chunk); self.bytes_out += len(chunk)
+
+def _build_passthrough_request_body(client_request_data: Dict[str, Any], chutes_ai_model_name: str) -> Dict[str, Any]:
+    """Applies the same config defaults and parameter merging as /api/chat. OpenAI fields the merging does
+    not know (tools, n, stream_options, ...) are forwarded unchanged."""
+    client_params = {key: value for key, value in client_request_data.items() if key not in ("model", "messages")}
+    client_messages: List[Dict[str, Any]] = client_request_data["messages"]
+    if SYSTEM_PROMPT and SYSTEM_PROMPT.strip() and not any(msg.get("role") == "system" for msg in client_messages):
+        client_messages = [{"role": "system", "content": SYSTEM_PROMPT}] + client_messages
+    backend_llm_body = _build_backend_llm_request_body(chutes_ai_model_name, client_messages, client_params, {})
+    for key, value in client_params.items():
+        if value is not None and key not in backend_llm_body: backend_llm_body[key] = value
+    backend_llm_body["stream"] = bool(client_request_data.get("stream"))
+    return backend_llm_body
+
+def _find_usage(response_tail: bytes) -> Optional[Dict[str, Any]]:
+    """Parses only the JSON document carrying "usage" out of the end of an upstream response body."""
+    usage_at = response_tail.rfind(b'"usage"')
+    if usage_at == -1: return None
+    event_start = response_tail.rfind(LLM_SSE_DATA_FIELD, 0, usage_at)
+    if event_start == -1: document = response_tail  # Non-streaming response: the body is one JSON document.
+    else:
+        event_end = response_tail.find(b"\n", usage_at)
+        document = response_tail[event_start + len(LLM_SSE_DATA_FIELD):event_end if event_end != -1 else len(response_tail)]
+    try: usage_info = _json_loads(document).get("usage")
+    except (ValueError, AttributeError): return None
+    return usage_info if isinstance(usage_info, dict) else None
+
+async def _passthrough_attempt(
+        app: web.Application, endpoint: "UpstreamEndpoint", backend_llm_body: Dict[str, Any],
+        relay: _PassthroughRelay, request_started_at: float
+) -> Tuple[Optional[str], bool]:
+    """Relays one upstream response to the client as raw byte chunks. Events carrying non-empty content are
+    counted with a byte search for metrics, and only the final usage event is parsed. Returns like _attempt_upstream."""
+    endpoint_body = dict(backend_llm_body, model=endpoint.backend_model(backend_llm_body["model"]))
+    observer = _UpstreamAttemptObserver(backend_llm_body["model"], endpoint.name, request_started_at)
+    relay.upstream_name = endpoint.name
+    endpoint.acquire(); PROXY_METRICS.upstream_in_flight.inc((endpoint.name,))
+    try:
+        async with app['aiohttp_session'].post(endpoint.url, data=_json_dumps_bytes(endpoint_body), headers=endpoint.auth_headers(), timeout=UPSTREAM_REQUEST_TIMEOUT) as llm_backend_response:
+            observer.on_connected(); PROXY_METRICS.upstream_responses.inc((endpoint.name, str(llm_backend_response.status)))
+            if llm_backend_response.status != 200:
+                relay.error_body = await llm_backend_response.read()
+                relay.error_status = llm_backend_response.status; relay.error_content_type = llm_backend_response.content_type
+                print(f"[Error] Backend LLM API Error ({endpoint.name}) - Status: {llm_backend_response.status}, Response: {relay.error_body[:200]!r}")
+                retryable = _record_upstream_error_status(endpoint, llm_backend_response.status, llm_backend_response.headers)
+                return f"Backend LLM Error (Status {llm_backend_response.status})", retryable
+            endpoint.observe_rate_limit_headers(llm_backend_response.headers)
+            await relay.prepare(llm_backend_response.headers.get("Content-Type"))
+            response_chunks: List[bytes] = []; previous_chunk = last_chunk = b""
+            async for chunk in llm_backend_response.content.iter_any():
+                observer.on_chunk(len(chunk))
+                if backend_llm_body["stream"]:
+                    token_count = sum(chunk.count(marker) for marker in LLM_CONTENT_MARKERS) - sum(chunk.count(marker) for marker in LLM_EMPTY_CONTENT_MARKERS)
+                    if token_count > 0: observer.on_token(token_count)
+                await relay.write(chunk)
+                if backend_llm_body["stream"]: previous_chunk, last_chunk = last_chunk, chunk
+                else: response_chunks.append(chunk)
+            _record_usage(backend_llm_body["model"], endpoint.name, _find_usage(previous_chunk + last_chunk if backend_llm_body["stream"] else b"".join(response_chunks)))
+            endpoint.record_success(observer.ttft() if backend_llm_body["stream"] else None)
+            return None, False
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e_connection:
+        endpoint.record_failure()
+        if observer.first_byte_at is None: PROXY_METRICS.upstream_responses.inc((endpoint.name, "error"))
+        print(f"[Error] Backend LLM connection error ({endpoint.name}): {type(e_connection).__name__}: {e_connection}")
+        return f"Backend LLM connection error: {str(e_connection) or type(e_connection).__name__}", True
+    finally:
+        endpoint.release(); PROXY_METRICS.upstream_in_flight.dec((endpoint.name,))
+        observer.on_finished()
+
+def _openai_error_response(status: int, message: str, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    return web.json_response({"error": {"message": message, "type": "proxy_error", "code": status}}, status=status, headers=headers)
+
+# Upstream Endpoints
+UPSTREAM_RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+UPSTREAM_DEFAULT_TTFT: float = 1.0      # Assumed time-to-first-token (seconds) for an endpoint without measurements yet
+UPSTREAM_EWMA_ALPHA: float = 0.2
+# aiohttp's default 5 minute limit on the whole response stays unless UPSTREAM_IDLE_TIMEOUT bounds stalled streams instead.
+UPSTREAM_REQUEST_TIMEOUT: aiohttp.ClientTimeout = aiohttp.ClientTimeout(
+    total=None if UPSTREAM_IDLE_TIMEOUT else 300, sock_connect=UPSTREAM_CONNECT_TIMEOUT, sock_read=UPSTREAM_IDLE_TIMEOUT)
+
+class UpstreamEndpoint:
+    """One OpenAI-compatible backend with its own token and model mapping, plus the moving
+    averages and circuit breaker state used to route requests to it."""
+
+    def __init__(self, name: str, url: str, token: str, weight: float = 1.0,
+                 model_map: Optional[Dict[str, str]] = None, models: Optional[List[str]] = None,
+                 health_url: Optional[str] = None, max_concurrency: int = UPSTREAM_MAX_CONCURRENCY,
+                 embeddings_url: Optional[str] = None, embedding_models: Optional[List[str]] = None,
+                 continuation_mode: str = STREAM_CONTINUATION_MODE, models_url: Optional[str] = None):
+        self.name = name; self.url = url; self.token = token; self.weight = max(float(weight), 0.01)
+        self.model_map: Dict[str, str] = model_map or {}
+        self.models: Optional[List[str]] = models; self.embedding_models: Optional[List[str]] = embedding_models
+        self.continuation_mode = continuation_mode
+        self.health_url = health_url or (url[:-len("/chat/completions")] + "/models" if url.endswith("/chat/completions") else None)
+        self.embeddings_url = embeddings_url or (url[:-len("/chat/completions")] + "/embeddings" if url.endswith("/chat/completions") else None)
+        self.models_url = models_url or (url[:-len("/chat/completions")] + "/models" if url.endswith("/chat/completions") else None)
+        self.served_models: Optional[set] = None  # Backend model ids from the model catalog, None until fetched
+        self.ewma_ttft: Optional[float] = None; self.ewma_error_rate = 0.0
+        self.inflight = 0; self.consecutive_failures = 0
+        self.circuit_open_until: Optional[float] = None; self.half_open_trial = False
+        self.total_requests = 0; self.total_failures = 0; self.total_rate_limited = 0
+        self.max_concurrency = max(int(max_concurrency), 1); self.window = float(self.max_concurrency)
+        self.rate_limited_until = 0.0; self._last_window_decrease = 0.0
+
+    def serves(self, model: str) -> bool:
+        if model in self.model_map: return True
+        return (self.models is None or model in self.models) and (self.served_models is None or model in self.served_models)
+
+    def serves_embeddings(self, model: str) -> bool:
+        """Embedding models are allowed separately, so a chat `models` list does not block them."""
+        return self.embeddings_url is not None and (self.embedding_models is None or model in self.embedding_models or model in self.model_map)
+
+    def backend_model(self, model: str) -> str:
+        return self.model_map.get(model, model)
+
+    def auth_headers(self) -> Dict[str, str]:
+        return {'Authorization': f'Bearer {self.token}'}
+
+    @property
+    def circuit_state(self) -> str:
+        if self.circuit_open_until is None: return "closed"
+        return "half_open" if time.monotonic() >= self.circuit_open_until else "open"
+
+    def available(self) -> bool:
+        if time.monotonic() < self.rate_limited_until: return False
+        circuit_state = self.circuit_state
+        return circuit_state == "closed" or (circuit_state == "half_open" and not self.half_open_trial)
+
+    def saturated(self) -> bool:
+        return self.inflight >= int(self.window)
+
+    def score(self) -> float:
+        """Lower is better: expected time-to-first-token, penalized by recent errors and current load, divided by weight."""
+        expected_ttft = self.ewma_ttft if self.ewma_ttft is not None else UPSTREAM_DEFAULT_TTFT
+        return expected_ttft * (1 + 10 * self.ewma_error_rate) * (1 + self.inflight) / self.weight
+
+    def acquire(self) -> None:
+        self.inflight += 1; self.total_requests += 1
+        if self.circuit_state == "half_open": self.half_open_trial = True
+
+    def release(self) -> None:
+        self.inflight -= 1
+
+    def record_success(self, ttft: Optional[float]) -> None:
+        if ttft is not None:
+            self.ewma_ttft = ttft if self.ewma_ttft is None else self.ewma_ttft + UPSTREAM_EWMA_ALPHA * (ttft - self.ewma_ttft)
+        self.ewma_error_rate -= UPSTREAM_EWMA_ALPHA * self.ewma_error_rate
+        self.consecutive_failures = 0; self.circuit_open_until = None; self.half_open_trial = False
+        self.window = min(self.window + 1.0 / self.window, float(self.max_concurrency))
+
+    def record_rate_limit(self, retry_after: Optional[float]) -> None:
+        """Multiplicative decrease of the concurrency window, at most once per second, and a pause of `retry_after` seconds."""
+        now = time.monotonic(); self.total_rate_limited += 1
+        self.ewma_error_rate += UPSTREAM_EWMA_ALPHA * (1.0 - self.ewma_error_rate)
+        if now - self._last_window_decrease >= 1.0:
+            self.window = max(self.window / 2, 1.0); self._last_window_decrease = now
+            if DEBUG_MODE: print(f"[DEBUG] Upstream '{self.name}' rate limited, concurrency window reduced to {self.window:.1f}.")
+        if retry_after is not None and retry_after > 0: self.rate_limited_until = max(self.rate_limited_until, now + retry_after)
+
+    def observe_rate_limit_headers(self, headers: Any) -> None:
+        """Pauses the endpoint until the reset time when the backend reports no remaining requests."""
+        if headers.get("x-ratelimit-remaining-requests") != "0": return
+        reset_after = _parse_duration_seconds(headers.get("x-ratelimit-reset-requests"))
+        if reset_after is not None: self.rate_limited_until = max(self.rate_limited_until, time.monotonic() + reset_after)
+
+    def record_failure(self) -> None:
+        self.ewma_error_rate += UPSTREAM_EWMA_ALPHA * (1.0 - self.ewma_error_rate)
+        self.consecutive_failures += 1; self.total_failures += 1
+        if self.half_open_trial or self.consecutive_failures >= UPSTREAM_CIRCUIT_FAILURE_THRESHOLD:
+            if self.circuit_open_until is None or self.half_open_trial:
+                print(f"[Error] Upstream '{self.name}' circuit opened for {UPSTREAM_CIRCUIT_OPEN_SECONDS}s after {self.consecutive_failures} consecutive failure(s).")
+            self.circuit_open_until = time.monotonic() + UPSTREAM_CIRCUIT_OPEN_SECONDS; self.half_open_trial = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name, "url": self.url, "weight": self.weight, "circuit": self.circuit_state,
+                "ewma_ttft": round(self.ewma_ttft, 4) if self.ewma_ttft is not None else None,
+                "ewma_error_rate": round(self.ewma_error_rate, 4), "inflight": self.inflight,
+                "requests": self.total_requests, "failures": self.total_failures, "rate_limited": self.total_rate_limited,
+                "concurrency_window": round(self.window, 2), "max_concurrency": self.max_concurrency,
+                "rate_limited_for": round(max(self.rate_limited_until - time.monotonic(), 0.0), 2)}
+
+def _parse_duration_seconds(value: Optional[str]) -> Optional[float]:
+    """Parses rate-limit reset values such as "2", "1.5s", "20ms" or "6m0s"."""
+    if not value: return None
+    value = value.strip()
+    try: return float(value)
+    except ValueError: pass
+    total_seconds = 0.0; number = ""; index = 0
+    units = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    while index < len(value):
+        char = value[index]
+        if char.isdigit() or char == ".": number += char; index += 1; continue
+        unit = "ms" if value.startswith("ms", index) else char
+        if unit not in units or not number: return None
+        total_seconds += float(number) * units[unit]; number = ""; index += len(unit)
+    return total_seconds if not number else None
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value: return None
+    try: return max(float(value), 0.0)
+    except ValueError: pass
+    try: return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError): return None
+
+class UpstreamPool:
+    """Latency-aware routing over the configured upstream endpoints."""
+
+    def __init__(self, endpoints: List[UpstreamEndpoint]):
+        self.endpoints = endpoints
+
+    @classmethod
+    def from_config(cls) -> "UpstreamPool":
+        if not UPSTREAM_ENDPOINTS:
+            return cls([UpstreamEndpoint("default", API_URL, API_TOKEN, embeddings_url=EMBEDDINGS_API_URL)])
+        endpoints = [UpstreamEndpoint(name=endpoint_conf.get("name", endpoint_conf["url"]), url=endpoint_conf["url"],
+                                      token=endpoint_conf.get("token", API_TOKEN), weight=endpoint_conf.get("weight", 1.0),
+                                      model_map=endpoint_conf.get("model_map"), models=endpoint_conf.get("models"),
+                                      health_url=endpoint_conf.get("health_url"), embeddings_url=endpoint_conf.get("embeddings_url"),
+                                      embedding_models=endpoint_conf.get("embedding_models"),
+                                      continuation_mode=endpoint_conf.get("continuation_mode", STREAM_CONTINUATION_MODE),
+                                      models_url=endpoint_conf.get("models_url"),
+                                      max_concurrency=endpoint_conf.get("max_concurrency", UPSTREAM_MAX_CONCURRENCY))
+                     for endpoint_conf in UPSTREAM_ENDPOINTS]
+        return cls(endpoints)
+
+    def candidates(self, model: str, embeddings: bool = False) -> List[UpstreamEndpoint]:
+        """Endpoints serving `model` (as an embedding model if `embeddings`) that are not open-circuited or
+        rate limited. Best score first, endpoints already at their concurrency window last."""
+        return sorted((endpoint for endpoint in self.endpoints
+                       if (endpoint.serves_embeddings(model) if embeddings else endpoint.serves(model)) and endpoint.available()),
+                      key=lambda endpoint: (endpoint.saturated(), endpoint.score()))
+
+    def capacity(self) -> int:
+        """Sum of the concurrency windows of the endpoints that currently accept traffic."""
+        return sum(int(endpoint.window) for endpoint in self.endpoints if endpoint.available())
+
+    def retry_after(self) -> float:
+        """Seconds until some endpoint accepts traffic again, 0 if one already does."""
+        if not self.endpoints or any(endpoint.available() for endpoint in self.endpoints): return 0.0
+        now = time.monotonic()
+        return max(min(max(endpoint.rate_limited_until, endpoint.circuit_open_until or 0.0) - now for endpoint in self.endpoints), 0.0)
+
+    async def probe(self, session: aiohttp.ClientSession, endpoint: UpstreamEndpoint) -> None:
+        if not endpoint.health_url: return
+        try:
+            async with session.get(endpoint.health_url, headers=endpoint.auth_headers(), timeout=aiohttp.ClientTimeout(total=10)) as probe_response:
+                healthy = probe_response.status < 500 and probe_response.status != 429
+        except (aiohttp.ClientError, asyncio.TimeoutError): healthy = False
+        if healthy:
+            if endpoint.circuit_open_until is not None and DEBUG_MODE: print(f"[DEBUG] Health probe succeeded, closing circuit of upstream '{endpoint.name}'.")
+            endpoint.consecutive_failures = 0; endpoint.circuit_open_until = None; endpoint.half_open_trial = False
+        else:
+            endpoint.record_failure()
+
+    async def run_health_checks(self, session: aiohttp.ClientSession) -> None:
+        while True:
+            await asyncio.gather(*(self.probe(session, endpoint) for endpoint in self.endpoints))
+            await asyncio.sleep(UPSTREAM_HEALTH_CHECK_INTERVAL)
+
+# Model Catalog
+def _ollama_model_tag(model_name: str) -> str:
+    return model_name if ":" in model_name else f"{model_name}:latest"
+
+def _ollama_tag_entry(model_name: str, model_entry: Dict[str, Any], parent_model: str = "") -> Dict[str, Any]:
+    created = model_entry.get("created")
+    modified_at = datetime.fromtimestamp(created, timezone.utc) if isinstance(created, (int, float)) and created > 0 else datetime.now(timezone.utc)
+    return {"name": _ollama_model_tag(model_name), "model": _ollama_model_tag(model_name), "modified_at": modified_at.isoformat(), "size": 0,
+            "digest": hashlib.sha256(model_name.encode()).hexdigest(),
+            "details": {"parent_model": parent_model, "format": "", "family": "general", "families": ["general"], "parameter_size": "N/A", "quantization_level": "N/A"}}
+
+class ModelCatalog:
+    """Models listed by the upstream endpoints on their /models URL, kept in memory for /api/tags, /api/show,
+    /v1/models and model validation. A list older than MODEL_CATALOG_TTL keeps being served while a single
+    background refresh replaces it, so no request waits on the network. Until the first list arrives, the
+    configured models are listed and no model is rejected."""
+
+    def __init__(self, upstream_pool: UpstreamPool, session: aiohttp.ClientSession):
+        self.upstream_pool = upstream_pool; self.session = session
+        self.models: Dict[str, Dict[str, Any]] = {}
+        self.fetched_at: Optional[float] = None; self.next_refresh_at = 0.0
+        self.refresh_task: Optional[asyncio.Task] = None
+        self.refreshes = 0; self.refresh_failures = 0
+        self._endpoint_model_lists: Dict[str, List[Dict[str, Any]]] = {}
+        self._tags: List[Dict[str, Any]] = self._build_tags()
+
+    def refresh_if_stale(self) -> None:
+        if not MODEL_CATALOG_ENABLED or time.monotonic() < self.next_refresh_at: return
+        if self.refresh_task is None or self.refresh_task.done(): self.refresh_task = asyncio.create_task(self.refresh())
+
+    async def _fetch_model_list(self, endpoint: UpstreamEndpoint) -> Optional[List[Dict[str, Any]]]:
+        if not endpoint.models_url: return None
+        try:
+            async with self.session.get(endpoint.models_url, headers=endpoint.auth_headers(), timeout=aiohttp.ClientTimeout(total=10)) as models_response:
+                if models_response.status != 200:
+                    print(f"[Error] Model list request to upstream '{endpoint.name}' failed with status {models_response.status}."); return None
+                model_list = (await models_response.json(content_type=None)).get("data")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, AttributeError) as e_fetch:
+            print(f"[Error] Failed to fetch the model list of upstream '{endpoint.name}': {type(e_fetch).__name__}: {e_fetch}"); return None
+        if not isinstance(model_list, list): return None
+        return [model_entry for model_entry in model_list if isinstance(model_entry, dict) and isinstance(model_entry.get("id"), str)]
+
+    async def refresh(self) -> None:
+        """Fetches every endpoint's model list. An endpoint whose fetch fails keeps its previous list."""
+        model_lists = await asyncio.gather(*(self._fetch_model_list(endpoint) for endpoint in self.upstream_pool.endpoints))
+        now = time.monotonic()
+        if all(model_list is None for model_list in model_lists):
+            self.refresh_failures += 1; self.next_refresh_at = now + min(MODEL_CATALOG_RETRY_INTERVAL, MODEL_CATALOG_TTL); return
+        models: Dict[str, Dict[str, Any]] = {}
+        for endpoint, model_list in zip(self.upstream_pool.endpoints, model_lists):
+            if model_list is not None: self._endpoint_model_lists[endpoint.name] = model_list
+            model_list = self._endpoint_model_lists.get(endpoint.name)
+            if model_list is None: continue
+            endpoint.served_models = {model_entry["id"] for model_entry in model_list}
+            client_names: Dict[str, List[str]] = {}
+            for client_model, backend_model in endpoint.model_map.items(): client_names.setdefault(backend_model, []).append(client_model)
+            for model_entry in model_list:
+                for model_name in [model_entry["id"]] + client_names.get(model_entry["id"], []):
+                    if endpoint.models is not None and model_name not in endpoint.models and model_name not in endpoint.model_map: continue
+                    catalog_entry = models.setdefault(model_name, {**model_entry, "id": model_name, "endpoints": []})
+                    catalog_entry["endpoints"].append(endpoint.name)
+        self.models = models; self.fetched_at = now; self.next_refresh_at = now + MODEL_CATALOG_TTL; self.refreshes += 1
+        self._tags = self._build_tags()
+        _register_metric_model_names(list(models))
+        if DEBUG_MODE: print(f"[DEBUG] Model catalog refreshed: {len(models)} model(s) from {sum(model_list is not None for model_list in model_lists)} upstream(s).")
+
+    def _build_tags(self) -> List[Dict[str, Any]]:
+        if self.fetched_at is None: tags = list(PROXY_ADVERTISED_MODELS)
+        else: tags = [_ollama_tag_entry(model_name, model_entry) for model_name, model_entry in sorted(self.models.items())]
+        for alias, backend_model in MODEL_ALIASES.items():
+            if self.fetched_at is None or backend_model in self.models: tags.append(_ollama_tag_entry(alias, self.models.get(backend_model, {}), backend_model))
+        return tags
+
+    def tags(self) -> List[Dict[str, Any]]:
+        self.refresh_if_stale()
+        return self._tags
+
+    def resolve(self, client_model: str, check_listed: bool = True) -> Optional[str]:
+        """Backend model id for a client model name or alias. None if `check_listed`, the catalog was fetched,
+        does not list the model and MODEL_CATALOG_REJECT_UNKNOWN is set."""
+        self.refresh_if_stale()
+        backend_model = MODEL_ALIASES.get(client_model) or MODEL_ALIASES.get(_backend_model_name(client_model)) or _backend_model_name(client_model)
+        if not (check_listed and MODEL_CATALOG_REJECT_UNKNOWN) or self.fetched_at is None or backend_model in self.models: return backend_model
+        return None
+
+    def show(self, client_model: str) -> Optional[Dict[str, Any]]:
+        """/api/show response for a model, None if it is unknown."""
+        backend_model = self.resolve(client_model)
+        if backend_model is None: return None
+        model_entry = self.models.get(backend_model, {})
+        context_length = model_entry.get("max_model_len") or model_entry.get("context_length") or MODEL_CONTEXT_WINDOWS.get(backend_model, DEFAULT_CONTEXT_WINDOW)
+        tag_entry = _ollama_tag_entry(client_model, model_entry, backend_model if backend_model != _backend_model_name(client_model) else "")
+        return {"modelfile": f"FROM {backend_model}\n", "parameters": "", "template": "", "details": tag_entry["details"],
+                "model_info": {"general.architecture": "general", "general.basename": backend_model, "general.context_length": context_length},
+                "capabilities": ["completion"], "modified_at": tag_entry["modified_at"]}
+
+    def openai_models(self) -> List[Dict[str, Any]]:
+        self.refresh_if_stale()
+        return [{"id": _backend_model_name(tag_entry["name"]), "object": "model", "owned_by": "ollama-chutesai-proxy",
+                 "created": int(datetime.fromisoformat(tag_entry["modified_at"]).timestamp())} for tag_entry in self._tags]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": MODEL_CATALOG_ENABLED, "models": len(self.models), "aliases": len(MODEL_ALIASES), "refreshes": self.refreshes,
+                "refresh_failures": self.refresh_failures, "age": round(time.monotonic() - self.fetched_at, 1) if self.fetched_at is not None else None}
+
+def _model_not_found_response(client_model: str) -> web.Response:
+    return web.json_response({"error": f"model '{client_model}' not found"}, status=404)
+
+# Admission Control
+ADMISSION_PRIORITY_CLASSES: Dict[str, int] = {"interactive": 0, "batch": 1}
+
+class AdmissionRejected(Exception):
+    def __init__(self, status: int, retry_after: float, message: str):
+        super().__init__(message)
+        self.status = status; self.retry_after = retry_after
+
+class AdmissionScheduler:
+    """Limits concurrent upstream requests and queues the rest. Higher priority classes are always served first,
+    and within a class clients share slots by weighted fair queuing (start-time fair queuing on virtual time).
+    The concurrency limit follows the AIMD windows of the upstream endpoints."""
+
+    def __init__(self, upstream_pool: UpstreamPool):
+        self.upstream_pool = upstream_pool
+        self.running = 0; self.queued = 0
+        self._queues: Dict[int, List[list]] = {priority: [] for priority in ADMISSION_PRIORITY_CLASSES.values()}
+        self._queued_per_client: Dict[str, int] = {}; self._client_finish_tags: Dict[str, float] = {}
+        self._virtual_time = 0.0; self._sequence = itertools.count()
+        self._wakeup_handle: Optional[asyncio.TimerHandle] = None
+        self.admitted = 0; self.rejected = 0; self.timed_out = 0
+
+    def capacity(self) -> int:
+        return min(ADMISSION_MAX_CONCURRENCY, self.upstream_pool.capacity())
+
+    async def acquire(self, client_key: str, priority: int) -> None:
+        """Waits for a slot. Raises AdmissionRejected when the queue is full or the wait times out."""
+        if self.queued == 0 and self.running < self.capacity():
+            self.running += 1; self.admitted += 1; return
+        if self.queued >= ADMISSION_MAX_QUEUE:
+            self.rejected += 1
+            raise AdmissionRejected(503, self.upstream_pool.retry_after(), "Server is busy, the request queue is full.")
+        if self._queued_per_client.get(client_key, 0) >= ADMISSION_MAX_QUEUE_PER_CLIENT:
+            self.rejected += 1
+            raise AdmissionRejected(429, self.upstream_pool.retry_after(), "Too many queued requests from this client.")
+        client_weight = max(float(ADMISSION_CLIENT_WEIGHTS.get(client_key, 1.0)), 0.01)
+        finish_tag = max(self._virtual_time, self._client_finish_tags.get(client_key, 0.0)) + 1.0 / client_weight
+        self._client_finish_tags[client_key] = finish_tag
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queues[priority], [finish_tag, next(self._sequence), waiter, client_key])
+        self.queued += 1; self._queued_per_client[client_key] = self._queued_per_client.get(client_key, 0) + 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(waiter, ADMISSION_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._forget_queued(client_key); self.timed_out += 1
+            raise AdmissionRejected(503, self.upstream_pool.retry_after(), "Timed out waiting for a free upstream slot.")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled(): self.release()
+            else: self._forget_queued(client_key)
+            raise
+        self.admitted += 1
+
+    def release(self) -> None:
+        self.running -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.queued and self.running < self.capacity():
+            queue_entry = self._pop_next()
+            if queue_entry is None: return
+            self.running += 1; self._virtual_time = queue_entry[0]
+            queue_entry[2].set_result(None)
+        if self.queued and self.capacity() == 0 and self._wakeup_handle is None:
+            self._wakeup_handle = asyncio.get_running_loop().call_later(max(self.upstream_pool.retry_after(), 0.05), self._on_wakeup)
+
+    def _on_wakeup(self) -> None:
+        self._wakeup_handle = None
+        self._dispatch()
+
+    def _pop_next(self) -> Optional[list]:
+        for priority in sorted(self._queues):
+            priority_queue = self._queues[priority]
+            while priority_queue:
+                queue_entry = heapq.heappop(priority_queue)
+                if queue_entry[2].done(): continue
+                self._forget_queued(queue_entry[3])
+                return queue_entry
+        return None
+
+    def _forget_queued(self, client_key: str) -> None:
+        self.queued -= 1
+        remaining = self._queued_per_client.get(client_key, 1) - 1
+        if remaining > 0: self._queued_per_client[client_key] = remaining
+        else:
+            self._queued_per_client.pop(client_key, None)
+            if self._client_finish_tags.get(client_key, 0.0) <= self._virtual_time: self._client_finish_tags.pop(client_key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self.running, "queued": self.queued, "capacity": self.capacity(),
+                "admitted": self.admitted, "rejected": self.rejected, "timed_out": self.timed_out,
+                "queued_per_priority": {name: sum(1 for entry in self._queues[priority] if not entry[2].done())
+                                        for name, priority in ADMISSION_PRIORITY_CLASSES.items()}}
+
+def _admission_client_key(request: web.Request) -> str:
+    """Identifies the client by the configured header, then its API key, then its remote address."""
+    if ADMISSION_CLIENT_HEADER and request.headers.get(ADMISSION_CLIENT_HEADER): return request.headers[ADMISSION_CLIENT_HEADER]
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer ") and len(authorization) > len("Bearer "): return authorization[len("Bearer "):]
+    return request.remote or "unknown"
+
+def _admission_priority(request: web.Request, client_key: str) -> int:
+    requested_priority = request.headers.get(ADMISSION_PRIORITY_HEADER, "") if ADMISSION_PRIORITY_HEADER else ""
+    if requested_priority.lower() in ADMISSION_PRIORITY_CLASSES: return ADMISSION_PRIORITY_CLASSES[requested_priority.lower()]
+    return ADMISSION_PRIORITY_CLASSES["batch" if client_key in ADMISSION_BATCH_CLIENTS else "interactive"]
+
+# Hedged Upstream Requests
+class HedgeController:
+    """Decides when a duplicate upstream request is sent and keeps the counters needed to tune hedging.
+    The delay follows a running percentile of observed time-to-first-token, and a credit that grows by
+    HEDGE_MAX_FRACTION per request caps how many requests get hedged."""
+    TTFT_WINDOW: int = 500
+    MIN_SAMPLES: int = 20
+    MAX_CREDIT: float = 5.0
+
+    def __init__(self):
+        self.ttft_samples: deque = deque(maxlen=self.TTFT_WINDOW)
+        self.credit = 0.0; self.requests = 0; self.hedges_sent = 0; self.hedge_wins = 0; self.budget_denied = 0
+
+    def record_ttft(self, ttft: float) -> None:
+        self.ttft_samples.append(ttft)
+
+    def delay(self) -> float:
+        if len(self.ttft_samples) < self.MIN_SAMPLES: return HEDGE_DEFAULT_DELAY
+        sorted_samples = sorted(self.ttft_samples)
+        return max(HEDGE_MIN_DELAY, sorted_samples[int(HEDGE_TTFT_PERCENTILE * (len(sorted_samples) - 1))])
+
+    def on_request(self) -> None:
+        self.requests += 1; self.credit = min(self.credit + HEDGE_MAX_FRACTION, self.MAX_CREDIT)
+
+    def try_acquire(self) -> bool:
+        if self.credit < 1.0:
+            self.budget_denied += 1; return False
+        self.credit -= 1.0; self.hedges_sent += 1
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {"requests": self.requests, "hedges_sent": self.hedges_sent, "hedge_wins": self.hedge_wins,
+                "hedge_win_rate": round(self.hedge_wins / self.hedges_sent, 4) if self.hedges_sent else 0.0,
+                "hedge_fraction": round(self.hedges_sent / self.requests, 4) if self.requests else 0.0,
+                "budget_denied": self.budget_denied, "current_delay": round(self.delay(), 4)}
+
+class _HedgeRace:
+    def __init__(self, shared_stream: _SharedUpstreamStream):
+        self.shared_stream = shared_stream
+        self.sinks: List["_HedgedAttemptSink"] = []
+        self.winner: Optional["_HedgedAttemptSink"] = None
+        self.won = asyncio.Event()
+
+class _HedgedAttemptSink:
+    """Stands in for the shared stream during a hedge race. The first attempt to publish content claims
+    the shared stream and cancels the other attempts."""
+
+    def __init__(self, race: _HedgeRace, label: str):
+        self.race = race; self.label = label
+        self.task: Optional[asyncio.Task] = None
+        self.last_backend_payload: Dict[str, Any] = {}
+        self.request_started_at = race.shared_stream.request_started_at; self.upstream_name = "none"
+
+    @property
+    def content_parts(self) -> List[str]:
+        return self.race.shared_stream.content_parts if self.race.winner is self else []
+
+    def claim(self) -> None:
+        if self.race.winner is not None: return
+        self.race.winner = self; self.race.won.set()
+        for other_sink in self.race.sinks:
+            if other_sink is not self and other_sink.task is not None: other_sink.task.cancel()
+
+    def publish(self, content_token: str, chunk_model: Optional[str]) -> None:
+        if self.race.winner is None: self.claim()
+        if self.race.winner is self: self.race.shared_stream.publish(content_token, chunk_model)
+
+async def _race_hedged_attempts(
+        app: web.Application, hedge_controller: HedgeController, candidates: List[UpstreamEndpoint],
+        backend_llm_body: Dict[str, Any], shared_stream: _SharedUpstreamStream
+) -> tuple[Optional[str], bool, List[UpstreamEndpoint]]:
+    """Sends the request to the best endpoint and, if no token arrived within the hedge delay, a duplicate to the
+    next best one (or the same one). Returns the result of the winning attempt and the endpoints used."""
+    loop = asyncio.get_running_loop()
+    hedge_controller.on_request()
+    hedge_at = loop.time() + hedge_controller.delay()
+    race = _HedgeRace(shared_stream); used_endpoints: List[UpstreamEndpoint] = []
+
+    def start_attempt(endpoint: UpstreamEndpoint, label: str) -> None:
+        attempt_sink = _HedgedAttemptSink(race, label)
+        attempt_sink.task = asyncio.create_task(_attempt_upstream(app, endpoint, backend_llm_body, attempt_sink))
+        race.sinks.append(attempt_sink); used_endpoints.append(endpoint)
+
+    start_attempt(candidates[0], "primary")
+    won_waiter = asyncio.ensure_future(race.won.wait())
+    hedge_decided = False; last_result: tuple[Optional[str], bool] = ("No upstream attempt completed.", True)
+    try:
+        while race.winner is None:
+            pending_tasks = [attempt_sink.task for attempt_sink in race.sinks if not attempt_sink.task.done()]
+            if not pending_tasks: break
+            wait_timeout = None if hedge_decided else max(hedge_at - loop.time(), 0.0)
+            done, _ = await asyncio.wait(pending_tasks + [won_waiter], timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+            if race.winner is not None: break
+            for attempt_sink in race.sinks:
+                if attempt_sink.task in done:
+                    last_result = attempt_sink.task.result()
+                    if last_result[0] is None or not last_result[1]:
+                        attempt_sink.claim()
+                        shared_stream.last_backend_payload = attempt_sink.last_backend_payload; shared_stream.upstream_name = attempt_sink.upstream_name
+                        return last_result[0], last_result[1], used_endpoints
+            if not done and not hedge_decided:
+                hedge_decided = True
+                if hedge_controller.try_acquire():
+                    hedge_endpoint = candidates[1] if len(candidates) > 1 else candidates[0]
+                    if DEBUG_MODE: print(f"[DEBUG] No first token after {hedge_controller.delay():.3f}s, hedging to upstream '{hedge_endpoint.name}'.")
+                    start_attempt(hedge_endpoint, "hedge")
+        if race.winner is None: return last_result[0], last_result[1], used_endpoints
+        if race.winner.label == "hedge": hedge_controller.hedge_wins += 1
+        attempt_error, retryable = await race.winner.task
+        shared_stream.last_backend_payload = race.winner.last_backend_payload; shared_stream.upstream_name = race.winner.upstream_name
+        return attempt_error, retryable, used_endpoints
+    finally:
+        won_waiter.cancel()
+        for attempt_sink in race.sinks:
+            if not attempt_sink.task.done(): attempt_sink.task.cancel()
+
+# Token Budget History Trimming
+TOKENS_PER_MESSAGE_OVERHEAD: int = 4
+
+def _heuristic_token_count(text: str) -> int:
+    """Roughly 4 ASCII characters per token, and one token per non-ASCII character (CJK text, emoji)."""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+def _load_tokenizer() -> Callable[[str], int]:
+    if TOKENIZER is None or TOKENIZER == "heuristic": return _heuristic_token_count
+    if callable(TOKENIZER): return TOKENIZER
+    if TOKENIZER == "tiktoken":
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding("cl100k_base")
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except ImportError:
+            print("[Error] TOKENIZER is 'tiktoken' but the tiktoken package is not installed. Falling back to the heuristic token count.")
+            return _heuristic_token_count
+    try:
+        module_name, function_name = str(TOKENIZER).split(":", 1)
+        return getattr(importlib.import_module(module_name), function_name)
+    except (ValueError, ImportError, AttributeError) as e:
+        print(f"[Error] Could not load TOKENIZER '{TOKENIZER}': {e}. Falling back to the heuristic token count.")
+        return _heuristic_token_count
+
+class TokenCounter:
+    """Token estimates per message, cached in an LRU keyed by a hash of the message content,
+    so the history a client resends every turn is only tokenized once."""
+
+    def __init__(self, tokenizer: Callable[[str], int], max_entries: int):
+        self.tokenizer = tokenizer; self.max_entries = max_entries
+        self._counts: "OrderedDict[bytes, int]" = OrderedDict()
+        self.hits = 0; self.misses = 0
+
+    def count_message(self, message: Dict[str, Any]) -> int:
+        content = message.get("content") or ""
+        if not isinstance(content, str): content = json.dumps(content, ensure_ascii=False)
+        content_key = hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+        token_count = self._counts.get(content_key)
+        if token_count is not None:
+            self._counts.move_to_end(content_key); self.hits += 1
+        else:
+            token_count = self.tokenizer(content); self.misses += 1
+            self._counts[content_key] = token_count
+            if len(self._counts) > self.max_entries: self._counts.popitem(last=False)
+        return token_count + TOKENS_PER_MESSAGE_OVERHEAD
+
+def _token_budget_for(backend_llm_body: Dict[str, Any]) -> int:
+    context_window = MODEL_CONTEXT_WINDOWS.get(backend_llm_body["model"], DEFAULT_CONTEXT_WINDOW)
+    return context_window - (backend_llm_body.get("max_tokens") or 0) - TOKEN_BUDGET_SAFETY_MARGIN
+
+def _trim_messages_to_token_budget(messages: List[Dict[str, Any]], token_budget: int, token_counter: TokenCounter) -> List[Dict[str, Any]]:
+    """Keeps the leading system messages and the latest turn, then as many older turns as fit in the budget.
+    A turn is a user message with the assistant/tool messages that follow it, and is kept or dropped whole."""
+    system_count = 0
+    while system_count < len(messages) and messages[system_count].get("role") == "system": system_count += 1
+    system_messages, history = messages[:system_count], messages[system_count:]
+    turns: List[List[Dict[str, Any]]] = []
+    for message in history:
+        if not turns or message.get("role") == "user": turns.append([message])
+        else: turns[-1].append(message)
+    if len(turns) <= 1: return messages
+
+    used_tokens = sum(token_counter.count_message(message) for message in system_messages)
+    kept_turns: List[List[Dict[str, Any]]] = []
+    for turn_index, turn in enumerate(reversed(turns)):
+        turn_tokens = sum(token_counter.count_message(message) for message in turn)
+        if turn_index > 0 and used_tokens + turn_tokens > token_budget: break
+        used_tokens += turn_tokens; kept_turns.append(turn)
+    if len(kept_turns) == len(turns): return messages
+    if DEBUG_MODE:
+        print(f"[DEBUG] Token budget {token_budget}: keeping {len(kept_turns)} of {len(turns)} turns (~{used_tokens} tokens).")
+    return system_messages + [message for turn in reversed(kept_turns) for message in turn]
+
+# Embeddings
+class EmbeddingUpstreamError(Exception):
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status; self.retry_after = retry_after
+
+def _embedding_error_response(e_embedding: EmbeddingUpstreamError) -> web.Response:
+    headers = {"Retry-After": str(max(math.ceil(e_embedding.retry_after), 1))} if e_embedding.retry_after is not None else None
+    return web.json_response({"error": str(e_embedding)}, status=e_embedding.status, headers=headers)
+
+async def _request_embeddings(app: web.Application, model: str, texts: List[str]) -> List[List[float]]:
+    """Sends one OpenAI-style /v1/embeddings request, failing over like chat requests. Raises EmbeddingUpstreamError."""
+    candidates = app['upstream_pool'].candidates(model, embeddings=True)[:UPSTREAM_MAX_ATTEMPTS]
+    last_error = EmbeddingUpstreamError(503, "No upstream endpoint is currently available for this embedding model.")
+    for endpoint in candidates:
+        endpoint.acquire(); PROXY_METRICS.upstream_in_flight.inc((endpoint.name,))
+        try:
+            request_body = _json_dumps_bytes({"model": endpoint.backend_model(model), "input": texts})
+            async with app['aiohttp_session'].post(endpoint.embeddings_url, data=request_body, headers=endpoint.auth_headers()) as embeddings_response:
+                PROXY_METRICS.upstream_responses.inc((endpoint.name, str(embeddings_response.status)))
+                if embeddings_response.status != 200:
+                    error_text = await embeddings_response.text()
+                    print(f"[Error] Backend Embeddings API Error ({endpoint.name}) - Status: {embeddings_response.status}, Response: {error_text}")
+                    last_error = EmbeddingUpstreamError(embeddings_response.status, f"Backend Embeddings Error (Status {embeddings_response.status}): {error_text[:200]}")
+                    if _record_upstream_error_status(endpoint, embeddings_response.status, embeddings_response.headers): continue
+                    raise last_error
+                embeddings_payload = _json_loads(await embeddings_response.read())
+            try: vectors = [item["embedding"] for item in sorted(embeddings_payload["data"], key=lambda item: item.get("index", 0))]
+            except (KeyError, TypeError, AttributeError): vectors = []
+            if len(vectors) != len(texts):
+                endpoint.record_failure()
+                raise EmbeddingUpstreamError(502, f"Backend returned {len(vectors)} embeddings for {len(texts)} inputs.")
+            endpoint.record_success(None)
+            _record_usage(model, endpoint.name, embeddings_payload.get("usage"))
+            return vectors
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e_connection:
+            endpoint.record_failure()
+            PROXY_METRICS.upstream_responses.inc((endpoint.name, "error"))
+            print(f"[Error] Backend Embeddings connection error ({endpoint.name}): {type(e_connection).__name__}: {e_connection}")
+            last_error = EmbeddingUpstreamError(502, f"Backend Embeddings connection error: {str(e_connection) or type(e_connection).__name__}")
+        finally:
+            endpoint.release(); PROXY_METRICS.upstream_in_flight.dec((endpoint.name,))
+    raise last_error
+
+class EmbeddingBatcher:
+    """Groups texts from concurrent embedding requests for the same model into one upstream call.
+    A batch is sent once it holds EMBEDDING_BATCH_MAX_SIZE texts or EMBEDDING_BATCH_MAX_WAIT seconds
+    after its first text arrived, and each caller gets back the vectors for its own texts. Every batch
+    takes one admission slot, with the most urgent priority of the callers in it."""
+
+    def __init__(self, app: web.Application, max_batch_size: int, max_wait: float):
+        self.app = app; self.max_batch_size = max(int(max_batch_size), 1); self.max_wait = max_wait
+        self._pending: Dict[str, List[Tuple[str, asyncio.Future, int]]] = {}
+        self._flush_timers: Dict[str, asyncio.TimerHandle] = {}
+
+    async def embed(self, model: str, texts: List[str], priority: int = ADMISSION_PRIORITY_CLASSES["interactive"]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self._enqueue(model, text, priority) for text in texts)))
+
+    def _enqueue(self, model: str, text: str, priority: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        batch = self._pending.setdefault(model, [])
+        batch.append((text, future, priority))
+        if len(batch) >= self.max_batch_size: self._flush(model)
+        elif len(batch) == 1: self._flush_timers[model] = asyncio.get_running_loop().call_later(self.max_wait, self._flush, model)
+        return future
+
+    def _flush(self, model: str) -> None:
+        flush_timer = self._flush_timers.pop(model, None)
+        if flush_timer is not None: flush_timer.cancel()
+        batch = self._pending.pop(model, None)
+        if not batch: return
+        batch_task = asyncio.create_task(self._send_batch(model, batch))
+        self.app['upstream_tasks'].add(batch_task); batch_task.add_done_callback(self.app['upstream_tasks'].discard)
+
+    async def _send_batch(self, model: str, batch: List[Tuple[str, asyncio.Future, int]]) -> None:
+        unique_texts = list(dict.fromkeys(text for text, future, _ in batch if not future.done()))
+        if not unique_texts: return
+        admission_scheduler: Optional[AdmissionScheduler] = self.app.get('admission_scheduler')
+        admitted = False
         try:
-            backend_payload = json.loads(data_json_str); last_backend_payload = backend_payload
-            choices = backend_payload.get("choices")
-            if not (choices and isinstance(choices, list) and choices): continue
-            delta = choices[0].get("delta", {}); content_token = delta.get("content")
-            if content_token is not None:
-                content_parts.append(content_token)
-                if stream_to_client:
-                    ollama_stream_chunk = { "model": backend_payload.get("model", client_model_requested),
-                                            "created_at": datetime.now(timezone.utc).isoformat(),
-                                            "message": {"role": delta.get("role", "assistant"), "content": content_token},
-                                            "done": False }
-                    await client_web_response.write(json.dumps(ollama_stream_chunk).encode('utf-8') + b'\n')
-                    await asyncio.sleep(0.001)
-            if choices[0].get("finish_reason") is not None: break
-        except json.JSONDecodeError: print(f"[Error] Ollama Proxy: Failed to parse JSON chunk from backend: {data_json_str}")
-        except Exception as e_chunk_proc: print(f"[Error] Ollama Proxy: Error processing backend chunk: {e_chunk_proc}, data: '{data_json_str}'")
-    return "".join(content_parts), last_backend_payload
+            if admission_scheduler is not None:
+                try: await admission_scheduler.acquire(f"embeddings:{model}", min(priority for _, _, priority in batch))
+                except AdmissionRejected as e_rejected: raise EmbeddingUpstreamError(e_rejected.status, str(e_rejected), e_rejected.retry_after)
+                admitted = True
+            PROXY_METRICS.embedding_batch_size.observe((_metric_model_label(model),), len(unique_texts))
+            vectors_by_text = dict(zip(unique_texts, await _request_embeddings(self.app, model, unique_texts)))
+        except asyncio.CancelledError:
+            self._fail_pending(batch, EmbeddingUpstreamError(503, "Embedding request was cancelled because the server is shutting down."))
+            raise
+        except Exception as e_batch:
+            if not isinstance(e_batch, EmbeddingUpstreamError): e_batch = EmbeddingUpstreamError(500, f"Unhandled server error: {str(e_batch)}")
+            self._fail_pending(batch, e_batch)
+            return
+        finally:
+            if admitted: admission_scheduler.release()
+        for text, future, _ in batch:
+            if not future.done(): future.set_result(vectors_by_text[text])
+
+    @staticmethod
+    def _fail_pending(batch: List[Tuple[str, asyncio.Future, int]], error: EmbeddingUpstreamError) -> None:
+        for _, future, _ in batch:
+            if not future.done(): future.set_exception(error)
+
+class EmbeddingCache:
+    """LRU of embedding vectors keyed by model and a hash of the text, so unchanged documents are not embedded again."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._vectors: "OrderedDict[bytes, List[float]]" = OrderedDict()
+        self.hits = 0; self.misses = 0
+
+    @staticmethod
+    def _key(model: str, text: str) -> bytes:
+        return hashlib.blake2b(model.encode("utf-8") + b"\0" + text.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        cache_key = self._key(model, text)
+        vector = self._vectors.get(cache_key)
+        if vector is None:
+            self.misses += 1; return None
+        self._vectors.move_to_end(cache_key); self.hits += 1
+        return vector
+
+    def put(self, model: str, text: str, vector: List[float]) -> None:
+        self._vectors[self._key(model, text)] = vector
+        if len(self._vectors) > self.max_entries: self._vectors.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"entries": len(self._vectors), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0}
+
+async def _embed_texts(app: web.Application, model: str, texts: List[str], priority: int) -> List[List[float]]:
+    embedding_cache: Optional[EmbeddingCache] = app.get('embedding_cache')
+    vectors: List[Optional[List[float]]] = [embedding_cache.get(model, text) for text in texts] if embedding_cache is not None else [None] * len(texts)
+    missing_indexes = [index for index, vector in enumerate(vectors) if vector is None]
+    if missing_indexes:
+        fetched_vectors = await app['embedding_batcher'].embed(model, [texts[index] for index in missing_indexes], priority)
+        for index, vector in zip(missing_indexes, fetched_vectors):
+            vectors[index] = vector
+            if embedding_cache is not None: embedding_cache.put(model, texts[index], vector)
+    return vectors
+
+# Response Cache
+def _is_deterministic_request(backend_llm_body: Dict[str, Any], client_cache_option: Optional[bool]) -> bool:
+    """A request may be served from cache if the client opted in, or if its sampling is pinned by a seed or temperature 0."""
+    if client_cache_option is not None: return bool(client_cache_option)
+    return backend_llm_body.get("seed") is not None or backend_llm_body.get("temperature") == 0
+
+def _backend_request_key(backend_llm_body: Dict[str, Any]) -> str:
+    canonical_body = json.dumps(backend_llm_body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical_body.encode("utf-8")).hexdigest()
+
+def _backend_response_finished(last_backend_payload: Dict[str, Any]) -> bool:
+    choices = last_backend_payload.get("choices")
+    return bool(choices and isinstance(choices, list) and choices[0].get("finish_reason") is not None)
+
+class ResponseCache:
+    """LRU cache of completed backend responses, bounded by the approximate byte size of the cached content."""
+    ENTRY_OVERHEAD_BYTES: int = 256
+    CHUNK_OVERHEAD_BYTES: int = 64
+
+    def __init__(self, max_bytes: int, persist_path: Optional[str] = None):
+        self.max_bytes = max_bytes; self.persist_path = persist_path
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.current_bytes = 0; self.hits = 0; self.misses = 0; self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1; return None
+        self._entries.move_to_end(key); self.hits += 1
+        return entry
+
+    def put(self, key: str, chunks: List[str], model: Optional[str], usage: Any) -> None:
+        size = self.ENTRY_OVERHEAD_BYTES + sum(len(chunk.encode("utf-8")) + self.CHUNK_OVERHEAD_BYTES for chunk in chunks)
+        if size > self.max_bytes: return
+        if key in self._entries: self.current_bytes -= self._entries.pop(key)["size"]
+        self._entries[key] = {"chunks": list(chunks), "model": model, "usage": usage, "size": size}
+        self.current_bytes += size
+        while self.current_bytes > self.max_bytes:
+            _, evicted_entry = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_entry["size"]; self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {"entries": len(self._entries), "bytes": self.current_bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0}
+
+    def load(self) -> None:
+        if not self.persist_path or not os.path.exists(self.persist_path): return
+        try:
+            with open(self.persist_path, "r", encoding="utf-8") as f: persisted = json.load(f)
+            for key, entry in persisted.get("entries", []):
+                self.put(key, entry["chunks"], entry.get("model"), entry.get("usage"))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[Error] Failed to load response cache from '{self.persist_path}': {e}"); return
+        if DEBUG_MODE: print(f"[DEBUG] Loaded {len(self._entries)} cached responses from '{self.persist_path}'.")
+
+    def save(self) -> None:
+        """Merges this cache into the persisted file instead of overwriting it, so workers sharing one
+        persist path each keep their entries. The merge runs under an exclusive lock on a sidecar file."""
+        if not self.persist_path: return
+        tmp_path = f"{self.persist_path}.{os.getpid()}.tmp"
+        try:
+            with open(f"{self.persist_path}.lock", "a") as lock_file:
+                if fcntl is not None: fcntl.flock(lock_file, fcntl.LOCK_EX)
+                merged_cache = ResponseCache(self.max_bytes, self.persist_path)
+                merged_cache.load()
+                for key, entry in self._entries.items(): merged_cache.put(key, entry["chunks"], entry.get("model"), entry.get("usage"))
+                entries = [[key, {k: v for k, v in entry.items() if k != "size"}] for key, entry in merged_cache._entries.items()]
+                with open(tmp_path, "w", encoding="utf-8") as f: json.dump({"entries": entries}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.persist_path)
+        except OSError as e: print(f"[Error] Failed to save response cache to '{self.persist_path}': {e}")
+
+async def _replay_cached_response(
+        request: web.Request, cached_entry: Dict[str, Any],
+        client_model_requested: str, stream_to_client: bool
+) -> web.StreamResponse:
+    response_headers = _ollama_response_headers(stream_to_client); response_headers['X-Proxy-Cache'] = 'HIT'
+    client_web_response = web.StreamResponse(status=200, reason='OK', headers=response_headers)
+    await client_web_response.prepare(request)
+    metric_labels = (_metric_model_label(_backend_model_name(client_model_requested)),)
+    try:
+        if stream_to_client:
+            chunk_encoder = _OllamaChunkEncoder(cached_entry.get("model") or client_model_requested)
+            if RESPONSE_CACHE_REPLAY_DELAY > 0:
+                for content_token in cached_entry["chunks"]:
+                    encoded_chunk = chunk_encoder.encode(content_token)
+                    await client_web_response.write(encoded_chunk)
+                    PROXY_METRICS.bytes_out.inc(metric_labels, len(encoded_chunk))
+                    await asyncio.sleep(RESPONSE_CACHE_REPLAY_DELAY)
+            else:
+                encoded_chunks = b"".join(chunk_encoder.encode(content_token) for content_token in cached_entry["chunks"])
+                await client_web_response.write(encoded_chunks)
+                PROXY_METRICS.bytes_out.inc(metric_labels, len(encoded_chunks))
+            ollama_final_obj = _build_ollama_final_obj(client_model_requested, "", cached_entry.get("usage"))
+            final_bytes = json.dumps(ollama_final_obj).encode('utf-8') + b'\n'
+        else:
+            ollama_final_obj = _build_ollama_final_obj(client_model_requested, "".join(cached_entry["chunks"]), cached_entry.get("usage"))
+            final_bytes = json.dumps(ollama_final_obj).encode('utf-8')
+        await client_web_response.write(final_bytes)
+        PROXY_METRICS.bytes_out.inc(metric_labels, len(final_bytes))
+        await client_web_response.write_eof()
+    except ConnectionResetError:
+        PROXY_METRICS.client_disconnects.inc(metric_labels)
+        if DEBUG_MODE: print("[DEBUG] Client disconnected during cached response replay.")
+    return client_web_response
+
+# Traffic Capture
+class TrafficCaptureWriter:
+    """Writes one JSON record per captured chat request to gzip-compressed JSONL files in CAPTURE_DIR. Requests
+    only append to an in-memory list; a background task hands batches to a thread for serialization, compression
+    and file I/O. A new file is started after CAPTURE_ROTATE_BYTES of uncompressed records, and the oldest
+    files beyond CAPTURE_MAX_FILES are deleted. Records arriving while CAPTURE_MAX_PENDING wait are dropped."""
+    WRITE_INTERVAL: float = 1.0
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.pending: List[Dict[str, Any]] = []
+        self.records_written = 0; self.records_dropped = 0; self.files_started = 0
+        self._file: Optional[gzip.GzipFile] = None; self._file_bytes = 0
+        self._file_lock = threading.Lock()  # close() may run while the writer thread is still busy with a batch
+
+    def should_capture(self) -> bool:
+        return CAPTURE_SAMPLE_RATE >= 1.0 or random.random() < CAPTURE_SAMPLE_RATE
+
+    def submit(self, capture_record: Dict[str, Any]) -> None:
+        if len(self.pending) >= CAPTURE_MAX_PENDING: self.records_dropped += 1; return
+        self.pending.append(capture_record)
+
+    def _start_file(self) -> None:
+        if self._file is not None: self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        file_name = f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.files_started:04d}.jsonl.gz"
+        self._file = gzip.open(os.path.join(self.directory, file_name), "wb"); self._file_bytes = 0; self.files_started += 1
+        capture_files = sorted((entry for entry in os.scandir(self.directory) if entry.name.startswith("capture-") and entry.name.endswith(".jsonl.gz")),
+                               key=lambda entry: entry.stat().st_mtime)
+        for old_file in capture_files[:max(len(capture_files) - CAPTURE_MAX_FILES, 0)]:
+            try: os.remove(old_file.path)
+            except OSError: pass
+
+    def _write_batch(self, capture_records: List[Dict[str, Any]]) -> None:
+        with self._file_lock: self._write_records(capture_records)
+
+    def _write_records(self, capture_records: List[Dict[str, Any]]) -> None:
+        try:
+            for capture_record in capture_records:
+                record_line = _json_dumps_bytes(capture_record) + b"\n"
+                if self._file is None or self._file_bytes + len(record_line) > CAPTURE_ROTATE_BYTES: self._start_file()
+                self._file.write(record_line); self._file_bytes += len(record_line); self.records_written += 1
+            if self._file is not None: self._file.flush()
+        except (OSError, TypeError, ValueError) as e: print(f"[Error] Failed to write traffic capture to '{self.directory}': {e}")
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.WRITE_INTERVAL)
+            if not self.pending: continue
+            capture_records, self.pending = self.pending, []
+            await loop.run_in_executor(None, self._write_batch, capture_records)
+
+    def close(self) -> None:
+        capture_records, self.pending = self.pending, []
+        with self._file_lock:
+            if capture_records: self._write_records(capture_records)
+            if self._file is not None: self._file.close(); self._file = None
+        if self.records_dropped: print(f"[Warning] Traffic capture dropped {self.records_dropped} record(s) because the writer fell behind.")
+
+def _build_capture_record(
+        request: web.Request, request_started_at: float, client_model_requested: str, backend_llm_body: Dict[str, Any],
+        stream_to_client: bool, source: str, status: int,
+        shared_stream: Optional[_SharedUpstreamStream] = None, cached_entry: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """Compact record of one chat request: arrival time, message sizes, sampling parameters, outcome, token counts
+    and, for requests that started the upstream stream, the token arrival timeline as gaps in milliseconds
+    (the first one measured from the start of the upstream stream, i.e. after any admission wait)."""
+    now = time.monotonic(); backend_messages: List[Dict[str, Any]] = backend_llm_body["messages"]
+    capture_record: Dict[str, Any] = {
+        "ts": round(time.time() - (now - request_started_at), 3), "model": client_model_requested, "backend_model": backend_llm_body["model"],
+        "stream": stream_to_client, "client": hashlib.blake2b(_admission_client_key(request).encode("utf-8"), digest_size=6).hexdigest(),
+        "source": source, "status": status, "duration_ms": round((now - request_started_at) * 1000, 1),
+        "roles": "".join(str(message.get("role", "?"))[:1] for message in backend_messages),
+        "message_chars": [len(str(message.get("content") or "")) for message in backend_messages],
+        "params": {key: value for key, value in backend_llm_body.items() if key not in ("model", "messages", "stream")}}
+    if not CAPTURE_REDACT_CONTENT: capture_record["messages"] = backend_messages
+    content_parts: Optional[List[str]] = None; usage_info: Any = None
+    if shared_stream is not None:
+        content_parts = shared_stream.content_parts; usage_info = shared_stream.last_backend_payload.get("usage")
+        capture_record["upstream"] = shared_stream.upstream_name
+        if shared_stream.error is not None: capture_record["error"] = shared_stream.error[:200]
+        if source == "upstream" and shared_stream.token_times is not None:
+            capture_record["queue_ms"] = round((shared_stream.started_at - request_started_at) * 1000, 1)
+            token_gaps_ms: List[float] = []; previous_at = shared_stream.started_at
+            for token_at in shared_stream.token_times: token_gaps_ms.append(round((token_at - previous_at) * 1000, 1)); previous_at = token_at
+            capture_record["token_ms"] = token_gaps_ms; capture_record["token_chars"] = [len(part) for part in content_parts[:len(token_gaps_ms)]]
+    elif cached_entry is not None:
+        content_parts = cached_entry["chunks"]; usage_info = cached_entry.get("usage")
+    if content_parts is not None:
+        capture_record["output_chars"] = sum(len(part) for part in content_parts)
+        if not CAPTURE_REDACT_CONTENT: capture_record["output"] = "".join(content_parts)
+    if isinstance(usage_info, dict):
+        capture_record["prompt_tokens"] = usage_info.get("prompt_tokens"); capture_record["completion_tokens"] = usage_info.get("completion_tokens")
+    return capture_record
 
 # Ollama-compatible API Handlers
 async def handle_ollama_tags(request: web.Request) -> web.Response:
     """ /api/tags - Returns a list of models available through this proxy."""
-    return web.json_response({"models": PROXY_ADVERTISED_MODELS})
+    return web.json_response({"models": request.app['model_catalog'].tags()})
+
+async def handle_ollama_show(request: web.Request) -> web.Response:
+    """ /api/show - Returns details of one model from the model catalog."""
+    try: client_request_data: Dict[str, Any] = await request.json()
+    except json.JSONDecodeError: return web.json_response({"error": "Invalid JSON body. Please send a valid JSON."}, status=400)
+    client_model_from_request = client_request_data.get("model") or client_request_data.get("name")
+    if not isinstance(client_model_from_request, str) or not client_model_from_request:
+        return web.json_response({"error": "'model' field is required in the request body."}, status=400)
+    model_details = request.app['model_catalog'].show(client_model_from_request)
+    if model_details is None: return _model_not_found_response(client_model_from_request)
+    return web.json_response(model_details)
 
 async def handle_ollama_version(request: web.Request) -> web.Response:
     """ /api/version - Returns a version for this proxy server."""
     return web.json_response({"version": PROXY_VERSION})
 
+async def handle_metrics(request: web.Request) -> web.Response:
+    """ /metrics - Returns proxy metrics in the Prometheus text exposition format, summed over all worker processes."""
+    metrics_exchange: Optional[WorkerMetricsExchange] = request.app.get('metrics_exchange')
+    worker_snapshots = metrics_exchange.read_others() if metrics_exchange is not None else []
+    return web.Response(body=PROXY_METRICS.render(worker_snapshots).encode('utf-8'), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def handle_upstream_stats(request: web.Request) -> web.Response:
+    """ /api/upstreams - Returns routing and circuit breaker state of the upstream endpoints."""
+    hedge_controller: Optional[HedgeController] = request.app.get('hedge_controller')
+    admission_scheduler: Optional[AdmissionScheduler] = request.app.get('admission_scheduler')
+    return web.json_response({"upstreams": [endpoint.stats() for endpoint in request.app['upstream_pool'].endpoints],
+                              "hedging": hedge_controller.stats() if hedge_controller is not None else {"enabled": False},
+                              "admission": admission_scheduler.stats() if admission_scheduler is not None else {"enabled": False},
+                              "model_catalog": request.app['model_catalog'].stats()})
+
+async def handle_cache_stats(request: web.Request) -> web.Response:
+    """ /api/cache/stats - Returns hit/miss counters of the response cache and the embedding cache."""
+    response_cache: Optional[ResponseCache] = request.app.get('response_cache')
+    embedding_cache: Optional[EmbeddingCache] = request.app.get('embedding_cache')
+    cache_stats = {"enabled": True, **response_cache.stats()} if response_cache is not None else {"enabled": False}
+    cache_stats["embeddings"] = {"enabled": True, **embedding_cache.stats()} if embedding_cache is not None else {"enabled": False}
+    return web.json_response(cache_stats)
+
+async def handle_openai_models(request: web.Request) -> web.Response:
+    """ /v1/models - Returns the models available through this proxy in the OpenAI format."""
+    return web.json_response({"object": "list", "data": request.app['model_catalog'].openai_models()})
+
+async def handle_openai_chat_completions(request: web.Request) -> web.StreamResponse:
+    """ /v1/chat/completions - OpenAI-compatible passthrough. The upstream response is relayed to the client unchanged."""
+    try: client_request_data: Dict[str, Any] = _json_loads(await request.read())
+    except ValueError: return _openai_error_response(400, "Invalid JSON body. Please send a valid JSON.")
+    if not isinstance(client_request_data, dict) or not client_request_data.get("messages"):
+        return _openai_error_response(400, "'messages' field is required in the request body.")
+    request_started_at = time.monotonic()
+    client_model_from_request: str = client_request_data.get("model") or MODEL_NAME
+    resolved_model_name = request.app['model_catalog'].resolve(client_model_from_request)
+    if resolved_model_name is None: return _openai_error_response(404, f"The model '{client_model_from_request}' does not exist.")
+    backend_llm_body = _build_passthrough_request_body(client_request_data, resolved_model_name)
+    if DEBUG_MODE:
+        print("\n[DEBUG] Final passthrough request body to backend LLM (Chutes.ai):")
+        print(json.dumps(backend_llm_body, indent=2, ensure_ascii=False)); print("-" * 40)
+    chutes_ai_model_name: str = backend_llm_body["model"]
+    metric_model = _metric_model_label(chutes_ai_model_name)
+    admission_scheduler: Optional[AdmissionScheduler] = request.app.get('admission_scheduler')
+    if admission_scheduler is not None:
+        client_key = _admission_client_key(request)
+        try: await admission_scheduler.acquire(client_key, _admission_priority(request, client_key))
+        except AdmissionRejected as e_rejected:
+            return _openai_error_response(e_rejected.status, str(e_rejected), {"Retry-After": str(max(math.ceil(e_rejected.retry_after), 1))})
+
+    relay = _PassthroughRelay(request)
+    PROXY_METRICS.client_streams_in_flight.inc((metric_model,))
+    try:
+        candidates = request.app['upstream_pool'].candidates(chutes_ai_model_name)[:UPSTREAM_MAX_ATTEMPTS]
+        attempt_error: Optional[str] = "No upstream endpoint is currently available for this model."
+        for endpoint in candidates:
+            attempt_error, retryable = await _passthrough_attempt(request.app, endpoint, backend_llm_body, relay, request_started_at)
+            if attempt_error is None or not retryable or relay.client_response is not None: break
+            if DEBUG_MODE: print(f"[DEBUG] Upstream '{endpoint.name}' failed before the first byte, trying the next endpoint.")
+        if attempt_error is not None and relay.client_response is None:
+            if relay.error_status is not None:
+                return web.Response(status=relay.error_status, body=relay.error_body, headers={"Content-Type": relay.error_content_type})
+            return _openai_error_response(503 if not candidates else 502, attempt_error)
+        if attempt_error is not None and backend_llm_body["stream"]:
+            await relay.write(b"data: " + _json_dumps_bytes({"error": {"message": attempt_error, "type": "proxy_error"}}) + b"\n\n")
+    except ConnectionResetError:
+        PROXY_METRICS.client_disconnects.inc((metric_model,))
+        if DEBUG_MODE: print("[DEBUG] Client disconnected before the response was complete.")
+    finally:
+        if admission_scheduler is not None: admission_scheduler.release()
+        PROXY_METRICS.client_streams_in_flight.dec((metric_model,))
+        PROXY_METRICS.bytes_out.inc((metric_model,), relay.bytes_out)
+        PROXY_METRICS.request_duration.observe((metric_model, relay.upstream_name), time.monotonic() - request_started_at)
+    if not relay.client_response.task.done():
+        try: await relay.client_response.write_eof()
+        except Exception: pass
+    return relay.client_response
+
+async def handle_ollama_embed(request: web.Request) -> web.Response:
+    """ /api/embed - Returns embeddings for one input text or a list of them."""
+    try: client_request_data: Dict[str, Any] = await request.json()
+    except json.JSONDecodeError: return web.json_response({"error": "Invalid JSON body. Please send a valid JSON."}, status=400)
+    request_started_at = time.monotonic()
+    client_model_from_request: Optional[str] = client_request_data.get("model") or EMBEDDING_MODEL_NAME
+    input_texts = client_request_data.get("input")
+    if isinstance(input_texts, str): input_texts = [input_texts]
+    if not client_model_from_request: return web.json_response({"error": "'model' field is required in the request body."}, status=400)
+    if not isinstance(input_texts, list) or not all(isinstance(text, str) for text in input_texts):
+        return web.json_response({"error": "'input' must be a string or a list of strings."}, status=400)
+    embedding_model_name = request.app['model_catalog'].resolve(client_model_from_request, check_listed=False)
+    try: vectors = await _embed_texts(request.app, embedding_model_name, input_texts, _admission_priority(request, _admission_client_key(request)))
+    except EmbeddingUpstreamError as e_embedding: return _embedding_error_response(e_embedding)
+    return web.json_response({"model": client_model_from_request, "embeddings": vectors,
+                              "total_duration": int((time.monotonic() - request_started_at) * 1e9), "load_duration": 0,
+                              "prompt_eval_count": sum(_heuristic_token_count(text) for text in input_texts)})
+
+async def handle_ollama_embeddings(request: web.Request) -> web.Response:
+    """ /api/embeddings - Legacy endpoint returning the embedding of a single prompt."""
+    try: client_request_data: Dict[str, Any] = await request.json()
+    except json.JSONDecodeError: return web.json_response({"error": "Invalid JSON body. Please send a valid JSON."}, status=400)
+    client_model_from_request: Optional[str] = client_request_data.get("model") or EMBEDDING_MODEL_NAME
+    prompt = client_request_data.get("prompt")
+    if not client_model_from_request: return web.json_response({"error": "'model' field is required in the request body."}, status=400)
+    if not isinstance(prompt, str): return web.json_response({"error": "'prompt' must be a string."}, status=400)
+    embedding_model_name = request.app['model_catalog'].resolve(client_model_from_request, check_listed=False)
+    try: vectors = await _embed_texts(request.app, embedding_model_name, [prompt], _admission_priority(request, _admission_client_key(request)))
+    except EmbeddingUpstreamError as e_embedding: return _embedding_error_response(e_embedding)
+    return web.json_response({"embedding": vectors[0]})
+
 async def ollama_chat_handler(request: web.Request) -> web.Union[web.StreamResponse, web.Response]:
     try: client_request_data: Dict[str, Any] = await request.json()
     except json.JSONDecodeError: return web.json_response({"error": "Invalid JSON body. Please send a valid JSON."}, status=400)
+    request_started_at = time.monotonic()
     client_model_from_request: str = client_request_data.get("model", MODEL_NAME)
     client_messages: List[Dict[str, str]] = client_request_data.get("messages", [])
     stream_to_client: bool = client_request_data.get("stream", True)
     client_options: Dict[str, Any] = client_request_data.get("options", {})
+    client_cache_option: Optional[bool] = client_options.get("cache")
+    client_options = {k: v for k, v in client_options.items() if k != "cache"}
     if not client_messages: return web.json_response({"error": "'messages' field is required in the request body."}, status=400)
-    chutes_ai_model_name: str = client_model_from_request
-    if ":" in chutes_ai_model_name and chutes_ai_model_name.endswith(":latest"): chutes_ai_model_name = chutes_ai_model_name[:-len(":latest")]
+    resolved_model_name = request.app['model_catalog'].resolve(client_model_from_request)
+    if resolved_model_name is None: return _model_not_found_response(client_model_from_request)
+    chutes_ai_model_name: str = resolved_model_name
     backend_llm_messages: List[Dict[str, str]] = []
     has_system_message_from_client = any(msg.get("role") == "system" for msg in client_messages)
 
@@ -231,39 +1968,70 @@ async def ollama_chat_handler(request: web.Request) -> web.Union[web.StreamRespo
 
 
     backend_llm_body_final = _build_backend_llm_request_body(chutes_ai_model_name, backend_llm_messages, client_options, client_request_data)
+    token_counter: Optional[TokenCounter] = request.app.get('token_counter')
+    if token_counter is not None:
+        backend_llm_body_final["messages"] = _trim_messages_to_token_budget(backend_llm_body_final["messages"], _token_budget_for(backend_llm_body_final), token_counter)
     if DEBUG_MODE:
         print("\n[DEBUG] Final request body to backend LLM (Chutes.ai):")
         print(json.dumps(backend_llm_body_final, indent=2, ensure_ascii=False)); print("-" * 40)
-    response_headers = {'Cache-Control': 'no-cache', 'Connection': 'keep-alive'}
-    if stream_to_client: response_headers['Content-Type'] = 'application/x-ndjson'
-    else: response_headers['Content-Type'] = 'application/json'
+    request_key = _backend_request_key(backend_llm_body_final)
+    capture_writer: Optional[TrafficCaptureWriter] = request.app.get('capture_writer')
+    capture_request = capture_writer is not None and capture_writer.should_capture()
+    response_cache: Optional[ResponseCache] = request.app.get('response_cache')
+    cache_key: Optional[str] = None
+    if response_cache is not None and _is_deterministic_request(backend_llm_body_final, client_cache_option):
+        cache_key = request_key
+        cached_entry = response_cache.get(cache_key)
+        if cached_entry is not None:
+            if DEBUG_MODE: print(f"[DEBUG] Response cache HIT for key {cache_key[:16]}.")
+            cached_web_response = await _replay_cached_response(request, cached_entry, client_model_from_request, stream_to_client)
+            PROXY_METRICS.request_duration.observe((_metric_model_label(chutes_ai_model_name), "cache"), time.monotonic() - request_started_at)
+            if capture_request:
+                capture_writer.submit(_build_capture_record(request, request_started_at, client_model_from_request, backend_llm_body_final,
+                                                            stream_to_client, "cache", 200, cached_entry=cached_entry))
+            return cached_web_response
+
+    inflight_streams: Dict[str, _SharedUpstreamStream] = request.app['inflight_streams']
+    shared_stream = inflight_streams.get(request_key) if REQUEST_COALESCING_ENABLED else None
+    if shared_stream is None:
+        admission_scheduler: Optional[AdmissionScheduler] = request.app.get('admission_scheduler')
+        if admission_scheduler is not None:
+            client_key = _admission_client_key(request)
+            try: await admission_scheduler.acquire(client_key, _admission_priority(request, client_key))
+            except AdmissionRejected as e_rejected:
+                if DEBUG_MODE: print(f"[DEBUG] Admission rejected ({e_rejected.status}): {e_rejected}")
+                if capture_request:
+                    capture_writer.submit(_build_capture_record(request, request_started_at, client_model_from_request, backend_llm_body_final,
+                                                                stream_to_client, "rejected", e_rejected.status))
+                return web.json_response({"error": str(e_rejected)}, status=e_rejected.status,
+                                         headers={"Retry-After": str(max(math.ceil(e_rejected.retry_after), 1))})
+            shared_stream = inflight_streams.get(request_key) if REQUEST_COALESCING_ENABLED else None
+            if shared_stream is not None: admission_scheduler.release()
+    if shared_stream is not None:
+        if DEBUG_MODE: print(f"[DEBUG] Attaching to in-flight upstream {request_key[:16]} ({shared_stream.subscribers} client(s) already attached).")
+        capture_source = "coalesced"
+    else:
+        shared_stream = _SharedUpstreamStream(request_key, request_started_at); capture_source = "upstream"
+        if capture_request: shared_stream.token_times = []
+        if REQUEST_COALESCING_ENABLED: inflight_streams[request_key] = shared_stream
+        shared_stream.task = asyncio.create_task(_run_shared_upstream(request.app, backend_llm_body_final, shared_stream, cache_key))
+        request.app['upstream_tasks'].add(shared_stream.task)
+        shared_stream.task.add_done_callback(request.app['upstream_tasks'].discard)
+        if request.app.get('admission_scheduler') is not None:
+            shared_stream.task.add_done_callback(lambda _: request.app['admission_scheduler'].release())
+    shared_stream.attach()
+
+    response_headers = _ollama_response_headers(stream_to_client)
+    if cache_key is not None: response_headers['X-Proxy-Cache'] = 'MISS'
     client_web_response = web.StreamResponse(status=200, reason='OK', headers=response_headers)
-    await client_web_response.prepare(request)
+    metric_model = _metric_model_label(chutes_ai_model_name)
+    PROXY_METRICS.client_streams_in_flight.inc((metric_model,))
     try:
-        async with request.app['aiohttp_session'].post(API_URL, json=backend_llm_body_final, headers={'Authorization': f'Bearer {API_TOKEN}'}) as llm_backend_response:
-            if llm_backend_response.status != 200:
-                error_text = await llm_backend_response.text()
-                print(f"[Error] Backend LLM API Error - Status: {llm_backend_response.status}, Response: {error_text}")
-                ollama_error_obj = {"model": client_model_from_request, "created_at": datetime.now(timezone.utc).isoformat(),
-                                    "message": {"role": "assistant", "content": ""}, "done": True,
-                                    "error": f"Backend LLM Error (Status {llm_backend_response.status}): {error_text[:200]}"}
-                await client_web_response.write(json.dumps(ollama_error_obj).encode('utf-8') + (b'\n' if stream_to_client else b''))
-                return client_web_response
-            full_assistant_content, last_backend_payload = await _transform_and_stream_llm_response(llm_backend_response, client_web_response, client_model_from_request, stream_to_client)
-            ollama_final_obj: Dict[str, Any] = {"model": client_model_from_request, "created_at": datetime.now(timezone.utc).isoformat(),
-                                                "message": {"role": "assistant", "content": "" if stream_to_client else full_assistant_content},
-                                                "done": True }
-            usage_info = last_backend_payload.get("usage")
-            if isinstance(usage_info, dict):
-                if usage_info.get("prompt_tokens") is not None: ollama_final_obj["prompt_eval_count"] = usage_info.get("prompt_tokens")
-                if usage_info.get("completion_tokens") is not None: ollama_final_obj["eval_count"] = usage_info.get("completion_tokens")
-                if usage_info.get("total_tokens") is not None: ollama_final_obj["total_tokens_backend"] = usage_info.get("total_tokens")
-
-            if stream_to_client:
-                await client_web_response.write(json.dumps(ollama_final_obj).encode('utf-8') + b'\n')
-            else:
-                ollama_final_obj["message"]["content"] = full_assistant_content
-                await client_web_response.write(json.dumps(ollama_final_obj).encode('utf-8'))
+        await client_web_response.prepare(request)
+        await _relay_shared_stream_to_client(shared_stream, client_web_response, client_model_from_request, stream_to_client)
+    except ConnectionResetError:
+        PROXY_METRICS.client_disconnects.inc((metric_model,))
+        if DEBUG_MODE: print("[DEBUG] Client disconnected before the response was complete.")
     except Exception as e_handler:
         error_message = f"Unhandled server error: {str(e_handler)}"; print(f"[Error] Ollama Proxy Handler: {error_message}")
         ollama_error_obj = {"model": client_model_from_request, "created_at": datetime.now(timezone.utc).isoformat(),
@@ -273,37 +2041,164 @@ async def ollama_chat_handler(request: web.Request) -> web.Union[web.StreamRespo
                 await client_web_response.write(json.dumps(ollama_error_obj).encode('utf-8') + (b'\n' if stream_to_client else b''))
         except Exception as write_e: print(f"[Error] Failed to write final error to client: {write_e}")
     finally:
+        shared_stream.detach()
+        PROXY_METRICS.client_streams_in_flight.dec((metric_model,))
+        PROXY_METRICS.request_duration.observe((metric_model, shared_stream.upstream_name), time.monotonic() - request_started_at)
+        if capture_request:
+            capture_writer.submit(_build_capture_record(request, request_started_at, client_model_from_request, backend_llm_body_final,
+                                                        stream_to_client, capture_source, 200, shared_stream=shared_stream))
         if client_web_response.prepared and not client_web_response.task.done():
             try: await client_web_response.write_eof()
             except Exception: pass
     return client_web_response
 
+# Worker Processes
+class WorkerMetricsExchange:
+    """Shares metrics between worker processes through snapshot files in a directory owned by the supervisor.
+    Each worker rewrites its own file every WORKER_METRICS_INTERVAL seconds, and /metrics adds the other
+    workers' latest snapshots to the live metrics of the worker that answers the scrape."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.own_path = _worker_metrics_path(directory, os.getpid())
+
+    def write(self) -> None:
+        tmp_path = f"{self.own_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f: f.write(_json_dumps_bytes(PROXY_METRICS.snapshot()))
+            os.replace(tmp_path, self.own_path)
+        except OSError as e: print(f"[Warning] Could not write metrics snapshot to '{self.own_path}': {e}")
+
+    def read_others(self) -> List[Dict[str, Any]]:
+        worker_snapshots = []
+        try: file_names = os.listdir(self.directory)
+        except OSError: return worker_snapshots
+        for file_name in file_names:
+            path = os.path.join(self.directory, file_name)
+            if not file_name.endswith(".json") or path == self.own_path: continue
+            try:
+                with open(path, "rb") as f: worker_snapshots.append(_json_loads(f.read()))
+            except (OSError, ValueError): continue  # The worker exited and its file was removed.
+        return worker_snapshots
+
+    async def run(self) -> None:
+        while True:
+            self.write()
+            await asyncio.sleep(WORKER_METRICS_INTERVAL)
+
+    def remove(self) -> None:
+        try: os.remove(self.own_path)
+        except OSError: pass
+
+def _worker_metrics_path(directory: str, pid: int) -> str:
+    return os.path.join(directory, f"worker-{pid}.json")
+
+@web.middleware
+async def _track_requests_in_flight(request: web.Request, handler: Callable) -> web.StreamResponse:
+    """Counts requests being served so shutdown can wait for them, and turns new ones away once draining has started."""
+    lifecycle = request.app['lifecycle']
+    if lifecycle['draining']:
+        return web.json_response({"error": "Server is shutting down, please retry."}, status=503, headers={"Retry-After": "1", "Connection": "close"})
+    lifecycle['requests_in_flight'] += 1
+    try: return await handler(request)
+    finally: lifecycle['requests_in_flight'] -= 1
+
+async def _drain_requests_in_flight(app: web.Application, timeout: float) -> None:
+    lifecycle = app['lifecycle']
+    lifecycle['draining'] = True
+    deadline = time.monotonic() + timeout
+    while lifecycle['requests_in_flight'] > 0 and time.monotonic() < deadline: await asyncio.sleep(0.1)
+    if lifecycle['requests_in_flight'] > 0: print(f"[Warning] {lifecycle['requests_in_flight']} request(s) still in flight after {timeout}s, closing them.")
+
 # Application Setup and Main Execution
-async def init_app() -> web.Application:
-    """Initializes the aiohttp web application."""
-    app = web.Application()
+async def init_app(metrics_dir: Optional[str] = None) -> web.Application:
+    """Initializes the aiohttp web application. `metrics_dir` is set in worker processes to share metrics."""
+    app = web.Application(middlewares=[_track_requests_in_flight])
+    app['lifecycle'] = {"draining": False, "requests_in_flight": 0}
     session_headers = {"Content-Type": "application/json"}
     app['aiohttp_session'] = aiohttp.ClientSession(headers=session_headers)
+    app['upstream_pool'] = UpstreamPool.from_config()
+    app['model_catalog'] = ModelCatalog(app['upstream_pool'], app['aiohttp_session'])
+    app.on_startup.append(_start_model_catalog)
+    app.on_cleanup.append(_stop_model_catalog)
+    if UPSTREAM_HEALTH_CHECK_INTERVAL > 0:
+        app.on_startup.append(_start_upstream_health_checks)
+        app.on_cleanup.append(_stop_upstream_health_checks)
+    if TOKEN_BUDGET_TRIMMING_ENABLED: app['token_counter'] = TokenCounter(_load_tokenizer(), TOKEN_COUNT_CACHE_SIZE)
+    if HEDGING_ENABLED: app['hedge_controller'] = HedgeController()
+    if ADMISSION_CONTROL_ENABLED: app['admission_scheduler'] = AdmissionScheduler(app['upstream_pool'])
+    app['embedding_batcher'] = EmbeddingBatcher(app, EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_MAX_WAIT)
+    if EMBEDDING_CACHE_SIZE > 0: app['embedding_cache'] = EmbeddingCache(EMBEDDING_CACHE_SIZE)
+    app['inflight_streams'] = {}
+    app['upstream_tasks'] = set()
+    app.on_shutdown.append(_cancel_upstream_tasks)
+    if RESPONSE_CACHE_ENABLED:
+        app['response_cache'] = ResponseCache(RESPONSE_CACHE_MAX_BYTES, RESPONSE_CACHE_PERSIST_PATH)
+        app['response_cache'].load()
+        app.on_cleanup.append(_save_response_cache)
+    if CAPTURE_ENABLED:
+        app['capture_writer'] = TrafficCaptureWriter(CAPTURE_DIR)
+        app.on_startup.append(_start_capture_writer)
+        app.on_cleanup.append(_stop_capture_writer)
+    if metrics_dir is not None:
+        app['metrics_exchange'] = WorkerMetricsExchange(metrics_dir)
+        app.on_startup.append(_start_metrics_exchange)
+        app.on_cleanup.append(_stop_metrics_exchange)
     app.router.add_post("/api/chat", ollama_chat_handler)
+    app.router.add_post("/api/embed", handle_ollama_embed)
+    app.router.add_post("/api/embeddings", handle_ollama_embeddings)
     app.router.add_get("/api/tags", handle_ollama_tags)
+    app.router.add_post("/api/show", handle_ollama_show)
     app.router.add_get("/api/version", handle_ollama_version)
+    app.router.add_get("/api/cache/stats", handle_cache_stats)
+    app.router.add_get("/api/upstreams", handle_upstream_stats)
+    app.router.add_get("/metrics", handle_metrics)
+    app.router.add_post("/v1/chat/completions", handle_openai_chat_completions)
+    app.router.add_get("/v1/models", handle_openai_models)
     return app
 
-async def main():
-    """Main function to start the server."""
-    if not API_TOKEN:
-        print("[Fatal Error] API_TOKEN is not configured correctly in `config.py` or is invalid."); return
+async def _start_model_catalog(app: web.Application) -> None:
+    app['model_catalog'].refresh_if_stale()
 
-    app = await init_app()
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, "localhost", SERVER_PORT)
+async def _stop_model_catalog(app: web.Application) -> None:
+    refresh_task: Optional[asyncio.Task] = app['model_catalog'].refresh_task
+    if refresh_task is not None: refresh_task.cancel()
+
+async def _start_upstream_health_checks(app: web.Application) -> None:
+    app['upstream_health_task'] = asyncio.create_task(app['upstream_pool'].run_health_checks(app['aiohttp_session']))
+
+async def _stop_upstream_health_checks(app: web.Application) -> None:
+    app['upstream_health_task'].cancel()
+
+async def _cancel_upstream_tasks(app: web.Application) -> None:
+    for upstream_task in list(app['upstream_tasks']): upstream_task.cancel()
+
+async def _save_response_cache(app: web.Application) -> None:
+    app['response_cache'].save()
+
+async def _start_capture_writer(app: web.Application) -> None:
+    app['capture_writer_task'] = asyncio.create_task(app['capture_writer'].run())
+
+async def _stop_capture_writer(app: web.Application) -> None:
+    app['capture_writer_task'].cancel()
+    app['capture_writer'].close()
 
+async def _start_metrics_exchange(app: web.Application) -> None:
+    app['metrics_exchange_task'] = asyncio.create_task(app['metrics_exchange'].run())
+
+async def _stop_metrics_exchange(app: web.Application) -> None:
+    app['metrics_exchange_task'].cancel()
+    app['metrics_exchange'].remove()
+
+def _print_startup_banner(upstream_pool: UpstreamPool, worker_count: int) -> None:
     print("=======================================================================")
     print(f"Ollama-compatible API Server STARTED (Version: {PROXY_VERSION})")
-    print(f"Listening on: http://localhost:{SERVER_PORT}")
-    print(f"Endpoints: POST /api/chat, GET /api/tags, GET /api/version")
+    print(f"Listening on: http://{SERVER_HOST}:{SERVER_PORT}")
+    print(f"Endpoints: POST /api/chat, POST /api/embed, POST /api/embeddings, GET /api/tags, POST /api/show, GET /api/version, GET /api/cache/stats, GET /api/upstreams, GET /metrics")
+    print(f"OpenAI-compatible Endpoints: POST /v1/chat/completions, GET /v1/models")
     print(f"Default Model (if not specified by client): {MODEL_NAME}")
+    print(f"Upstream Endpoints: {', '.join(endpoint.name for endpoint in upstream_pool.endpoints)}")
+    if worker_count > 1: print(f"Worker Processes: {worker_count} (sharing port {SERVER_PORT})")
     print(f"")
     if SYSTEM_PROMPT and SYSTEM_PROMPT.strip() and DEBUG_MODE:
         sys_prompt_display = SYSTEM_PROMPT[:70] + ('...' if len(SYSTEM_PROMPT) > 70 else '')
@@ -311,12 +2206,24 @@ async def main():
     elif not (SYSTEM_PROMPT and SYSTEM_PROMPT.strip()) and DEBUG_MODE:
         print(f"Default System Prompt: Not set or ignored (was '{SPECIFIC_SYSTEM_PROMPT_TO_IGNORE}').")
 
+    if TOKEN_BUDGET_TRIMMING_ENABLED:
+        print(f"History Trimming: Token budget (context window {DEFAULT_CONTEXT_WINDOW} unless set per model in MODEL_CONTEXT_WINDOWS, minus max_tokens).")
     if MAX_HISTORY_MESSAGES == -1:
-        print("History Trimming: Disabled (MAX_HISTORY_MESSAGES = -1). All messages will be sent.")
+        if not TOKEN_BUDGET_TRIMMING_ENABLED: print("History Trimming: Disabled (MAX_HISTORY_MESSAGES = -1). All messages will be sent.")
     else:
         history_info = f"Remembering last approx. {MAX_HISTORY_MESSAGES} messages (incl. system prompt if active)."
         print(history_info)
 
+    if RESPONSE_CACHE_ENABLED:
+        persist_info = f", persisted to '{RESPONSE_CACHE_PERSIST_PATH}'" if RESPONSE_CACHE_PERSIST_PATH else ""
+        print(f"Response Cache: Enabled for deterministic requests ({RESPONSE_CACHE_MAX_BYTES // (1024 * 1024)} MiB budget{persist_info}).")
+
+    if CAPTURE_ENABLED:
+        print(f"Traffic Capture: Writing {CAPTURE_SAMPLE_RATE:.0%} of chat requests to '{CAPTURE_DIR}' ({'content redacted' if CAPTURE_REDACT_CONTENT else 'including content'}).")
+
+    if STREAM_CONTINUATION_ENABLED:
+        print(f"Stream Continuation: Enabled (up to {STREAM_CONTINUATION_MAX_RETRIES} continuation(s) per broken stream, mode '{STREAM_CONTINUATION_MODE}').")
+
     if DEBUG_MODE:
         print("DEBUG MODE IS ON. API request bodies and other debug info will be printed.")
 
@@ -324,9 +2231,29 @@ async def main():
     print("Press Ctrl+C to stop the server.")
     print("=======================================================================")
 
+async def main(metrics_dir: Optional[str] = None) -> bool:
+    """Main function to start the server. Runs until SIGINT/SIGTERM, then lets in-flight requests finish.
+    Returns False if the server could not start. `metrics_dir` is set when running as a worker process."""
+    if not API_TOKEN:
+        print("[Fatal Error] API_TOKEN is not configured correctly in `config.py` or is invalid."); return False
+
+    app = await init_app(metrics_dir)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, SERVER_HOST, SERVER_PORT, reuse_port=True if metrics_dir is not None else None)
+    if metrics_dir is None: _print_startup_banner(app['upstream_pool'], 1)
+
+    stop_requested = asyncio.Event()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        try: asyncio.get_running_loop().add_signal_handler(stop_signal, stop_requested.set)
+        except NotImplementedError: pass  # Windows: Ctrl+C raises KeyboardInterrupt instead.
+    started = False
     try:
         await site.start()
-        while True: await asyncio.sleep(3600)
+        started = True
+        await stop_requested.wait()
+        if metrics_dir is None: print("\nShutting down server...")
+        await _drain_requests_in_flight(app, WORKER_SHUTDOWN_TIMEOUT)
     except KeyboardInterrupt: print("\nShutting down server...")
     except OSError as e:
         print(f"\n[Error] Could not start server (e.g., port {SERVER_PORT} already in use?): {e}")
@@ -334,12 +2261,77 @@ async def main():
         if 'aiohttp_session' in app and app['aiohttp_session'] and not app['aiohttp_session'].closed:
             await app['aiohttp_session'].close()
         if 'runner' in locals() and runner: await runner.cleanup()
+        if metrics_dir is None: print("Server shut down successfully.")
+    return started
+
+def _run_event_loop(coroutine: Any) -> Any:
+    """Runs `coroutine` on uvloop when it is installed and USE_UVLOOP is set, otherwise on the default asyncio loop."""
+    if USE_UVLOOP:
+        try:
+            import uvloop
+            if hasattr(uvloop, "run"): return uvloop.run(coroutine)
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        except ImportError: pass
+    return asyncio.run(coroutine)
+
+WORKER_STARTUP_FAILED_EXIT_CODE: int = 3
+
+def _worker_process_main(metrics_dir: str) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Until the worker's loop installs its own handlers, Ctrl+C is handled by the supervisor.
+    if not _run_event_loop(main(metrics_dir)): sys.exit(WORKER_STARTUP_FAILED_EXIT_CODE)
+
+def _run_workers(worker_count: int) -> None:
+    """Pre-fork mode: runs `worker_count` server processes that all bind SERVER_PORT with SO_REUSEPORT.
+    Workers that die are restarted. On SIGINT/SIGTERM every worker is asked to drain and stop."""
+    _print_startup_banner(UpstreamPool.from_config(), worker_count)
+    metrics_dir = tempfile.mkdtemp(prefix="ollama-proxy-metrics-")
+    stopping = False
+    def request_stop(signum: int, frame: Any) -> None:
+        nonlocal stopping; stopping = True
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    workers: List[Optional[multiprocessing.Process]] = [None] * worker_count
+    started_at: List[float] = [0.0] * worker_count
+    def start_worker(worker_index: int) -> None:
+        worker = multiprocessing.Process(target=_worker_process_main, args=(metrics_dir,), name=f"ollama-proxy-worker-{worker_index}")
+        worker.start()
+        workers[worker_index] = worker; started_at[worker_index] = time.monotonic()
+
+    try:
+        for worker_index in range(worker_count): start_worker(worker_index)
+        while not stopping:
+            time.sleep(0.5)
+            for worker_index, worker in enumerate(workers):
+                if stopping or worker is None or worker.is_alive(): continue
+                workers[worker_index] = None
+                try: os.remove(_worker_metrics_path(metrics_dir, worker.pid))
+                except OSError: pass
+                if worker.exitcode == WORKER_STARTUP_FAILED_EXIT_CODE:
+                    print(f"[Fatal Error] Worker {worker_index} could not start the server, stopping."); stopping = True; break
+                print(f"[Warning] Worker {worker_index} (pid {worker.pid}) exited with code {worker.exitcode}, restarting.")
+                if time.monotonic() - started_at[worker_index] < 1.0: time.sleep(1.0)  # Avoid a tight crash loop.
+                start_worker(worker_index)
+        print("\nShutting down server...")
+    finally:
+        running_workers = [worker for worker in workers if worker is not None and worker.is_alive()]
+        for worker in running_workers: worker.terminate()
+        deadline = time.monotonic() + WORKER_SHUTDOWN_TIMEOUT + 5
+        for worker in running_workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+            if worker.is_alive(): worker.kill(); worker.join()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
         print("Server shut down successfully.")
 
 if __name__ == "__main__":
+    worker_count = WORKERS if WORKERS > 0 else (os.cpu_count() or 1)
+    if worker_count > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        print("[Warning] WORKERS > 1 needs SO_REUSEPORT, which this platform does not support. Running a single process.")
+        worker_count = 1
     try:
-        asyncio.run(main())
+        if worker_count > 1: _run_workers(worker_count)
+        else: _run_event_loop(main())
     except KeyboardInterrupt: print("\nApplication terminated by user. ")
     except SystemExit as e:
         if str(e): print(e)
-        print("Application exiting due to a fatal error.")
\ No newline at end of file
+        print("Application exiting due to a fatal error.")
@@ -0,0 +1,220 @@
+"""Replays captured traffic (CAPTURE_ENABLED) against the proxy offline.
+
+Reads the capture files written by the proxy, starts stub_upstream.py with the captured token timelines and
+the proxy (with config.py, pointed at the stub), then sends every captured chat request at its original
+arrival offset. The stub answers each request with the token sizes and inter-arrival times captured for it,
+so the report compares the TTFT, inter-token gaps and durations seen through the replayed proxy with the
+captured ones. Message contents are synthesized from the captured sizes unless the capture holds them.
+Results are printed as JSON. Example:
+
+    python replay.py captures/ --speed 2 --output replay.json
+"""
+import argparse
+import asyncio
+import bisect
+import glob
+import gzip
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+from typing import List, Dict, Any, Optional
+from benchmark import BENCHMARK_DIR, ProcessTreeSampler, _percentiles, _percentile_delta, _start_proxy, _wait_until_ready, _stop_process
+from stub_upstream import STUB_FILLER
+
+CAPTURED_ROLES: Dict[str, str] = {"s": "system", "u": "user", "a": "assistant"}
+
+def load_capture_records(paths: List[str]) -> List[Dict[str, Any]]:
+    """Records from capture files and directories of capture files, in arrival order."""
+    capture_files: List[str] = []
+    for path in paths:
+        capture_files.extend(sorted(glob.glob(os.path.join(path, "capture-*.jsonl*"))) if os.path.isdir(path) else [path])
+    records: List[Dict[str, Any]] = []
+    for capture_file in capture_files:
+        opener = gzip.open if capture_file.endswith(".gz") else open
+        try:
+            with opener(capture_file, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip(): records.append(json.loads(line))
+        except EOFError: print(f"[Warning] {capture_file} is truncated (still being written?); replaying the records read so far.", file=sys.stderr)
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+def _synthetic_messages(record: Dict[str, Any], replay_id: str) -> List[Dict[str, Any]]:
+    """The captured messages, or filler messages of the captured roles and sizes; the last one carries the replay id."""
+    if record.get("messages"):
+        messages = [dict(message) for message in record["messages"]]
+    else:
+        messages = [{"role": CAPTURED_ROLES.get(role, "user"), "content": (STUB_FILLER * (chars // len(STUB_FILLER) + 1))[:chars]}
+                    for role, chars in zip(record["roles"], record["message_chars"])]
+    if not messages: messages = [{"role": "user", "content": ""}]
+    messages[-1]["content"] = f"{messages[-1].get('content') or ''} [replay-id:{replay_id}]"
+    return messages
+
+def _captured_ttft(record: Dict[str, Any], speed: float) -> Optional[float]:
+    if not record["stream"] or not record.get("token_ms"): return None
+    return (record.get("queue_ms", 0.0) + record["token_ms"][0]) / 1000 / speed
+
+class ReplayResult:
+    __slots__ = ("record", "outcome", "status", "send_lag", "ttft", "token_gaps", "duration", "_event_ends", "_text_length")
+
+    def __init__(self, record: Dict[str, Any]):
+        self.record = record; self.outcome = "ok"; self.status = 0; self.send_lag = 0.0; self.ttft: Optional[float] = None
+        self.token_gaps: List[float] = []; self.duration = 0.0; self._text_length = 0
+        self._event_ends: List[int] = list(itertools.accumulate(record.get("token_chars") or []))
+
+    def record_chunk(self, content: str, gap: Optional[float]) -> None:
+        """Spreads the gap before a chunk over the captured token events it carries, mapped through the captured
+        event sizes, so the proxy's merged chunks are compared per captured event."""
+        events_before = bisect.bisect_right(self._event_ends, self._text_length); self._text_length += len(content)
+        chunk_events = max(1, bisect.bisect_right(self._event_ends, self._text_length) - events_before)
+        if gap is not None: self.token_gaps.extend([gap / chunk_events] * chunk_events)
+
+# Replay
+async def _send_replayed_request(session: aiohttp.ClientSession, base_url: str, record: Dict[str, Any], replay_id: str) -> ReplayResult:
+    result = ReplayResult(record); started_at = time.perf_counter(); last_chunk_at = None
+    body = {"model": record["backend_model"], "messages": _synthetic_messages(record, replay_id), "stream": record["stream"],
+            "options": {**record.get("params", {}), "cache": False}}
+    async with session.post(f"{base_url}/api/chat", json=body) as response:
+        result.status = response.status
+        if response.status != 200:
+            result.outcome = f"http_{response.status}"; await response.read(); return result
+        async for line in response.content:
+            if not line.strip(): continue
+            chunk = json.loads(line)
+            if chunk.get("error"): result.outcome = "upstream_error"; break
+            if chunk.get("message", {}).get("content"):
+                now = time.perf_counter()
+                if last_chunk_at is None: result.ttft = now - started_at
+                result.record_chunk(chunk["message"]["content"], now - last_chunk_at if last_chunk_at is not None else None)
+                last_chunk_at = now
+    result.duration = time.perf_counter() - started_at
+    if not record["stream"]: result.ttft = None
+    return result
+
+async def replay_records(base_url: str, records: List[Dict[str, Any]], settings: argparse.Namespace) -> List[ReplayResult]:
+    """Sends each record at its captured offset from the first one (divided by settings.speed)."""
+    first_ts = records[0]["ts"]; started_at = time.perf_counter()
+
+    async def replay_one(replay_index: int, record: Dict[str, Any]) -> ReplayResult:
+        scheduled_at = started_at + (record["ts"] - first_ts) / settings.speed
+        await asyncio.sleep(max(0.0, scheduled_at - time.perf_counter()))
+        send_lag = time.perf_counter() - scheduled_at
+        try: result = await _send_replayed_request(session, base_url, record, str(replay_index))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            result = ReplayResult(record); result.outcome = "transport_error"
+        result.send_lag = send_lag
+        return result
+
+    timeout = aiohttp.ClientTimeout(total=settings.request_timeout)
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        return list(await asyncio.gather(*(replay_one(replay_index, record) for replay_index, record in enumerate(records))))
+
+def summarize(results: List[ReplayResult], speed: float) -> Dict[str, Any]:
+    """Outcomes and latency percentiles of the replay next to the captured ones (scaled by the replay speed)."""
+    outcomes: Dict[str, int] = {}; status_mismatches = 0
+    for result in results:
+        outcomes[result.outcome] = outcomes.get(result.outcome, 0) + 1
+        if result.status != result.record["status"]: status_mismatches += 1
+    succeeded = [result for result in results if result.outcome == "ok"]
+    timed = [result for result in succeeded if result.record.get("token_ms")]
+    captured = {"ttft_ms": _percentiles([ttft for ttft in (_captured_ttft(result.record, speed) for result in timed) if ttft is not None]),
+                "inter_token_ms": _percentiles([gap_ms / 1000 / speed for result in timed if result.record["stream"] for gap_ms in result.record["token_ms"][1:]]),
+                "duration_ms": _percentiles([result.record["duration_ms"] / 1000 / speed for result in timed])}
+    replayed = {"ttft_ms": _percentiles([result.ttft for result in timed if result.ttft is not None]),
+                "inter_token_ms": _percentiles([gap for result in timed for gap in result.token_gaps]),
+                "duration_ms": _percentiles([result.duration for result in timed])}
+    return {"requests": len(results), "outcomes": outcomes, "status_mismatches": status_mismatches,
+            "requests_with_timeline": len(timed), "send_lag_ms": _percentiles([result.send_lag for result in results]),
+            "captured": captured, "replayed": replayed,
+            "ttft_delta_ms": _percentile_delta(replayed["ttft_ms"], captured["ttft_ms"]),
+            "inter_token_delta_ms": _percentile_delta(replayed["inter_token_ms"], captured["inter_token_ms"]),
+            "duration_delta_ms": _percentile_delta(replayed["duration_ms"], captured["duration_ms"])}
+
+# Process Management
+def _write_timelines(records: List[Dict[str, Any]], timelines_path: str, speed: float) -> None:
+    """Token timelines by replay id for stub_upstream.py --timelines, scaled by the replay speed. Records without
+    one (cache hits, coalesced and rejected requests) are answered with their whole output after their duration."""
+    timelines: Dict[str, Dict[str, Any]] = {}
+    for replay_index, record in enumerate(records):
+        token_ms = record.get("token_ms") or [record["duration_ms"] if record["source"] != "cache" else 0.0]
+        token_chars = record.get("token_chars") or [max(record.get("output_chars") or 0, 1)]
+        timelines[str(replay_index)] = {"token_ms": [gap_ms / speed for gap_ms in token_ms], "token_chars": token_chars,
+                                        "prompt_tokens": record.get("prompt_tokens"), "completion_tokens": record.get("completion_tokens")}
+    with open(timelines_path, "w", encoding="utf-8") as f: json.dump(timelines, f)
+
+def _start_stub(settings: argparse.Namespace, models: List[str], timelines_path: str) -> subprocess.Popen:
+    stub_command = [sys.executable, os.path.join(BENCHMARK_DIR, "stub_upstream.py"), "--host", "127.0.0.1", "--port", str(settings.stub_port),
+                    "--timelines", timelines_path, "--models", *models]
+    return subprocess.Popen(stub_command, stdout=subprocess.DEVNULL)
+
+async def run_replay(settings: argparse.Namespace) -> Dict[str, Any]:
+    records = load_capture_records(settings.captures)
+    if settings.limit: records = records[:settings.limit]
+    if not records: raise SystemExit("[Fatal Error] No capture records found.")
+    stub_process = proxy_process = None
+    work_dir = tempfile.mkdtemp(prefix="ollama-proxy-replay-")
+    stub_url = f"http://127.0.0.1:{settings.stub_port}"
+    proxy_url = settings.proxy_url or f"http://127.0.0.1:{settings.proxy_port}"
+    try:
+        timelines_path = os.path.join(work_dir, "timelines.json")
+        _write_timelines(records, timelines_path, settings.speed)
+        stub_process = _start_stub(settings, sorted({record["backend_model"] for record in records}), timelines_path)
+        await _wait_until_ready(f"{stub_url}/v1/models", stub_process)
+        if not settings.proxy_url:
+            proxy_settings = argparse.Namespace(proxy_port=settings.proxy_port, set=["CAPTURE_ENABLED=False", *settings.set])
+            proxy_process = _start_proxy(proxy_settings, stub_url, work_dir)
+        await _wait_until_ready(f"{proxy_url}/api/version", proxy_process)
+        sampler = ProcessTreeSampler(proxy_process.pid) if proxy_process is not None and os.path.isdir("/proc") else None
+
+        captured_span = records[-1]["ts"] - records[0]["ts"]
+        print(f"Replaying {len(records)} requests captured over {captured_span:.1f}s at {settings.speed}x...", file=sys.stderr)
+        cpu_before = sampler.cpu_seconds() if sampler else None
+        results = await replay_records(proxy_url, records, settings)
+        report = {"settings": vars(settings), "captured_span_s": round(captured_span, 3), **summarize(results, settings.speed),
+                  "proxy_cpu_seconds": round(sampler.cpu_seconds() - cpu_before, 3) if sampler else None,
+                  "proxy_rss_mb": round(sampler.rss_bytes() / (1024 * 1024), 1) if sampler else None}
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"{stub_url}/stats") as response: report["stub_stats"] = await response.json()
+        return report
+    finally:
+        _stop_process(proxy_process); _stop_process(stub_process)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _print_summary(report: Dict[str, Any]) -> None:
+    print(f"{'':>16} {'captured p50/p99 ms':>22} {'replayed p50/p99 ms':>22} {'delta p50/p99 ms':>20}", file=sys.stderr)
+    for label, key in (("TTFT", "ttft_ms"), ("inter-token", "inter_token_ms"), ("duration", "duration_ms")):
+        captured = report["captured"][key] or {}; replayed = report["replayed"][key] or {}
+        delta = report[key.replace("_ms", "_delta_ms")] or {}
+        print(f"{label:>16} {str(captured.get('p50'))+'/'+str(captured.get('p99')):>22} {str(replayed.get('p50'))+'/'+str(replayed.get('p99')):>22} "
+              f"{str(delta.get('p50'))+'/'+str(delta.get('p99')):>20}", file=sys.stderr)
+    print(f"Outcomes: {report['outcomes']}, status mismatches: {report['status_mismatches']}, "
+          f"send lag p99: {(report['send_lag_ms'] or {}).get('p99')} ms", file=sys.stderr)
+
+def build_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Replays captured proxy traffic against a local stub upstream.")
+    parser.add_argument("captures", nargs="+", help="Capture files (.jsonl.gz) or directories containing them")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor; arrival offsets and token gaps are divided by it")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N records")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--stub-port", type=int, default=18201)
+    proxy_group = parser.add_argument_group("proxy")
+    proxy_group.add_argument("--proxy-url", help="Replay against an already running proxy (pointed at the stub) instead of starting main.py")
+    proxy_group.add_argument("--proxy-port", type=int, default=18200)
+    proxy_group.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="Extra config.py assignment for the started proxy, e.g. --set WORKERS=4")
+    return parser
+
+if __name__ == "__main__":
+    replay_settings = build_argument_parser().parse_args()
+    replay_report = asyncio.run(run_replay(replay_settings))
+    _print_summary(replay_report)
+    report_json = json.dumps(replay_report, indent=2)
+    if replay_settings.output:
+        with open(replay_settings.output, "w", encoding="utf-8") as f: f.write(report_json + "\n")
+    else: print(report_json)
@@ -0,0 +1,159 @@
+"""Synthetic OpenAI-compatible upstream for benchmarking the proxy offline.
+
+Streams generated tokens at a fixed rate after a fixed time-to-first-token, and can inject error
+responses and mid-stream connection drops. A request ending with an assistant message continues the
+token sequence after that partial answer, like a backend continuing a broken stream. Requests sent by
+replay.py are answered with the token timeline captured for them (--timelines). Example:
+
+    python stub_upstream.py --port 18001 --tokens-per-second 50 --ttft 0.2 --error-rate 0.01 --drop-rate 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from aiohttp import web
+from typing import Any, Dict, List, Optional
+
+STUB_VOCABULARY: List[str] = ["The", " quick", " brown", " fox", " jumps", " over", " the", " lazy", " dog", ".", " Lorem", " ipsum",
+                              " dolor", " sit", " amet", ",", " 1234", " \"quoted\"", " café", "\n"]
+
+STUB_FILLER: str = "".join(STUB_VOCABULARY)
+REPLAY_ID_PATTERN = re.compile(r"\[replay-id:(\w+)\]")
+
+def _sse_event(payload: Dict[str, Any]) -> bytes:
+    return b"data: " + json.dumps(payload).encode('utf-8') + b"\n\n"
+
+def _completion_chunk(model: str, content: str, finish_reason: Any = None, usage: Any = None) -> Dict[str, Any]:
+    chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+             "choices": [{"index": 0, "delta": {"content": content} if content else {}, "finish_reason": finish_reason}]}
+    if usage is not None: chunk["usage"] = usage
+    return chunk
+
+def _stub_tokens(token_count: int, start_index: int = 0) -> List[str]:
+    return [STUB_VOCABULARY[i % len(STUB_VOCABULARY)] for i in range(start_index, start_index + token_count)]
+
+def _stub_token_index(partial_content: str) -> int:
+    """Number of stub tokens that make up `partial_content`, i.e. where a continuation picks up the sequence."""
+    token_index = 0; covered_chars = 0
+    while covered_chars < len(partial_content):
+        covered_chars += len(STUB_VOCABULARY[token_index % len(STUB_VOCABULARY)]); token_index += 1
+    return token_index
+
+def _find_replay_timeline(timelines: Dict[str, Dict[str, Any]], messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Captured token timeline for a request sent by replay.py, which tags the last message with its record id."""
+    if not timelines or not messages: return None
+    replay_id_match = REPLAY_ID_PATTERN.search(str(messages[-1].get("content", "")))
+    return timelines.get(replay_id_match.group(1)) if replay_id_match else None
+
+def _filler_text(char_count: int) -> str:
+    return (STUB_FILLER * (char_count // len(STUB_FILLER) + 1))[:char_count]
+
+async def handle_chat_completions(request: web.Request) -> web.StreamResponse:
+    settings: argparse.Namespace = request.app['settings']; stats: Dict[str, int] = request.app['stats']
+    body = await request.json()
+    model = body.get("model", "stub-model")
+    stats["requests"] += 1
+    rng: random.Random = request.app['rng']
+    if rng.random() < settings.error_rate:
+        stats["errors_injected"] += 1
+        return web.json_response({"error": {"message": "Injected error from stub upstream."}}, status=settings.error_status)
+    messages = body.get("messages") or []
+    prompt_tokens = sum(len(str(message.get("content", ""))) // 4 for message in messages)
+    timeline = _find_replay_timeline(request.app['timelines'], messages)
+    if timeline is not None:
+        stats["replayed"] += 1
+        event_offsets = list(itertools.accumulate(gap_ms / 1000 for gap_ms in timeline["token_ms"]))
+        event_texts = [_filler_text(chars) for chars in timeline["token_chars"]]
+        completion_tokens = timeline.get("completion_tokens") or len(event_texts)
+        prompt_tokens = timeline.get("prompt_tokens") or prompt_tokens
+        response_after = event_offsets[-1] if event_offsets else settings.ttft
+    else:
+        start_index = _stub_token_index(str(messages[-1].get("content", ""))) if messages and messages[-1].get("role") == "assistant" else 0
+        if start_index: stats["continuations"] += 1
+        completion_tokens = int(body.get("max_tokens") or settings.tokens) if settings.respect_max_tokens else max(settings.tokens - start_index, 1)
+        tokens = _stub_tokens(completion_tokens, start_index)
+        chunk_interval = settings.chunk_size / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0
+        event_texts = ["".join(tokens[offset:offset + settings.chunk_size]) for offset in range(0, len(tokens), settings.chunk_size)]
+        event_offsets = [settings.ttft + chunk_index * chunk_interval for chunk_index in range(len(event_texts))]
+        response_after = settings.ttft + (len(tokens) / settings.tokens_per_second if settings.tokens_per_second > 0 else 0.0)
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+    loop = asyncio.get_running_loop(); started_at = loop.time()
+
+    if not body.get("stream"):
+        await asyncio.sleep(response_after)
+        return web.json_response({"id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model, "usage": usage,
+                                  "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(event_texts)}, "finish_reason": "stop"}]})
+
+    drop_after = len(event_texts) // 2 if rng.random() < settings.drop_rate else None
+    response = web.StreamResponse(status=200, headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+    for event_index, (event_offset, event_text) in enumerate(zip(event_offsets, event_texts)):
+        await asyncio.sleep(max(0.0, started_at + event_offset - loop.time()))
+        if drop_after is not None and event_index >= drop_after:
+            stats["drops_injected"] += 1
+            request.transport.abort()
+            return response
+        await response.write(_sse_event(_completion_chunk(model, event_text)))
+    await response.write(_sse_event(_completion_chunk(model, "", "stop", usage)))
+    await response.write(b"data: [DONE]\n\n")
+    stats["completed"] += 1
+    return response
+
+async def handle_embeddings(request: web.Request) -> web.Response:
+    settings: argparse.Namespace = request.app['settings']; stats: Dict[str, int] = request.app['stats']
+    body = await request.json()
+    input_texts = body.get("input") if isinstance(body.get("input"), list) else [body.get("input", "")]
+    stats["embedding_requests"] += 1; stats["embedding_inputs"] += len(input_texts)
+    await asyncio.sleep(settings.ttft)
+    vectors = [[(hash(text) >> shift & 0xFF) / 255.0 for shift in range(0, 8 * settings.embedding_dimensions, 8)] for text in input_texts]
+    return web.json_response({"object": "list", "model": body.get("model", "stub-model"),
+                              "data": [{"object": "embedding", "index": index, "embedding": vector} for index, vector in enumerate(vectors)],
+                              "usage": {"prompt_tokens": sum(len(text) // 4 for text in input_texts), "total_tokens": sum(len(text) // 4 for text in input_texts)}})
+
+async def handle_models(request: web.Request) -> web.Response:
+    return web.json_response({"object": "list", "data": [{"id": model, "object": "model", "owned_by": "stub"} for model in request.app['settings'].models]})
+
+async def handle_stats(request: web.Request) -> web.Response:
+    return web.json_response(request.app['stats'])
+
+def create_app(settings: argparse.Namespace) -> web.Application:
+    app = web.Application()
+    app['settings'] = settings
+    app['stats'] = {"requests": 0, "completed": 0, "errors_injected": 0, "drops_injected": 0, "continuations": 0, "replayed": 0, "embedding_requests": 0, "embedding_inputs": 0}
+    app['rng'] = random.Random(settings.seed)
+    app['timelines'] = {}
+    if settings.timelines:
+        with open(settings.timelines, encoding="utf-8") as f: app['timelines'] = json.load(f)
+    app.router.add_post("/v1/chat/completions", handle_chat_completions)
+    app.router.add_post("/v1/embeddings", handle_embeddings)
+    app.router.add_get("/v1/models", handle_models)
+    app.router.add_get("/stats", handle_stats)
+    return app
+
+def build_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Synthetic OpenAI-compatible SSE upstream for offline benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18001)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Token generation rate per stream after the first token")
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--chunk-size", type=int, default=1, help="Tokens per SSE event")
+    parser.add_argument("--tokens", type=int, default=128, help="Tokens per response")
+    parser.add_argument("--respect-max-tokens", action="store_true", help="Use the request's max_tokens as the response length when set")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of streams whose connection is dropped halfway")
+    parser.add_argument("--embedding-dimensions", type=int, default=8, help="Length of the vectors returned by /v1/embeddings")
+    parser.add_argument("--models", nargs="+", default=["stub-model"], help="Model ids listed on /v1/models")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for error and drop injection")
+    parser.add_argument("--timelines", help="JSON file of captured token timelines by replay id, written by replay.py")
+    return parser
+
+if __name__ == "__main__":
+    stub_settings = build_argument_parser().parse_args()
+    stub_settings.chunk_size = max(1, stub_settings.chunk_size)
+    print(f"Stub upstream listening on http://{stub_settings.host}:{stub_settings.port}/v1/chat/completions "
+          f"({stub_settings.tokens_per_second} tokens/s, TTFT {stub_settings.ttft}s, {stub_settings.tokens} tokens per response)")
+    web.run_app(create_app(stub_settings), host=stub_settings.host, port=stub_settings.port, print=None)